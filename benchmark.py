@@ -0,0 +1,568 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import cv2
+import h5py
+import numpy as np
+
+from capture import SyntheticCapture, ReplayCapture
+from codec import COMPRESSIONS, FILTERS, IMAGE_CODECS, read_frames
+from dataset import Recording
+from input_log import StateBlock
+from pipeline import WriterPipeline, POLICIES as BACKPRESSURE_POLICIES
+from preprocess import FramePool, FramePreprocessor
+from process_pool import ProcessFramePool
+from scheduler import FrameScheduler, POLICIES
+from storage import open_store, shard_files, STORES
+from view import load_gameplay_data
+
+# 与 GameRecorder 一致的状态向量维度：11个按键 + 鼠标位置、速度、按键
+STATE_DIM = 18
+
+
+def synthetic_frame(source, work=0.01, jitter=0.01):
+    """
+    从合成画面源取一帧，并模拟缩放/写盘的可变耗时
+    :param source: SyntheticCapture
+    :param work: 基础处理耗时（秒）
+    :param jitter: 额外随机耗时上限（秒）
+    :return: BGRA 画面
+    """
+    frame = source.grab()
+    time.sleep(work + random.uniform(0, jitter))
+    return frame
+
+
+def _percentiles(values):
+    values = np.asarray(values) * 1000
+    if len(values) == 0:
+        return {}
+    return {
+        'p50': float(np.percentile(values, 50)),
+        'p90': float(np.percentile(values, 90)),
+        'p99': float(np.percentile(values, 99)),
+        'max': float(np.max(values)),
+    }
+
+
+def _report(name, n, elapsed, jitter, skipped=0):
+    stats = _percentiles(jitter)
+    line = f"{name:>10}: {n} 帧, 实际帧率 {n / elapsed:.2f} FPS, 跳过 {skipped}, "
+    if not stats:
+        # 测试时间内一帧都没有采集到
+        print(line + "抖动(ms) 无数据")
+        return
+    print(line + f"抖动(ms) p50={stats['p50']:.2f} p90={stats['p90']:.2f} "
+          f"p99={stats['p99']:.2f} max={stats['max']:.2f}")
+
+
+def bench_scheduler(interval=0.05, duration=5.0, width=1280, height=720,
+                    work=0.01, jitter=0.01):
+    """
+    比较 sleep(interval) 与截止时间调度器的实际帧率和抖动
+    抖动定义为实际采集时间与计划采集时间之差
+    """
+    print(f"目标帧率 {1 / interval:.2f} FPS, 画面 {width}x{height}, "
+          f"模拟耗时 {work * 1000:.0f}~{(work + jitter) * 1000:.0f} ms")
+
+    source = SyntheticCapture(width, height)
+    source.open()
+
+    # 旧方式：处理完再 sleep 固定间隔
+    start = time.perf_counter()
+    stamps = []
+    while time.perf_counter() - start < duration:
+        stamps.append(time.perf_counter() - start)
+        synthetic_frame(source, work, jitter)
+        time.sleep(interval)
+    scheduled = np.arange(len(stamps)) * interval
+    _report('sleep', len(stamps), duration, np.array(stamps) - scheduled)
+
+    for policy in POLICIES:
+        scheduler = FrameScheduler(interval, policy=policy).start()
+        end = time.time() + duration
+        lateness = []
+        n = 0
+        while True:
+            tick = scheduler.wait()
+            if tick.actual >= end:
+                break
+            synthetic_frame(source, work, jitter)
+            lateness.append(tick.actual - tick.scheduled)
+            n += 1
+        _report(policy, n, duration, lateness, scheduler.skipped)
+    source.close()
+
+
+def bench_record(duration=5.0, width=1280, height=720, target_size=(320, 240),
+                 interval=0.05, layout='contiguous', backpressure='block',
+                 compression='none', process_workers=0, verbose=True, out_path=None):
+    """
+    端到端录制路径测试：合成画面源 -> 定频调度 -> 缩放/编码 -> 写盘管线 -> HDF5
+    与 GameRecorder.record_loop 的组织方式相同，不需要 Windows 或显示器
+    interval 为 0 时不限速，用于测量最大吞吐
+    :param out_path: 保留录制文件的路径，None 时写入临时目录并在结束后删除
+    :return: 结果字典
+    """
+    frame_shape = (target_size[1], target_size[0], 3)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = out_path or os.path.join(tmp, 'record.h5')
+        store = open_store(path, frame_shape, STATE_DIM, layout=layout, compression=compression)
+
+        def sink(items):
+            # 与 GameRecorder._write_batch 相同，写入出错时也归还这一批的全部槽位
+            try:
+                for slot, state, timestamp, scheduled, encoded in items:
+                    store.append(pool[slot], state, timestamp, scheduled, encoded)
+            finally:
+                for item in items:
+                    pool.release(item[0])
+
+        pipeline = WriterPipeline(sink, policy=backpressure,
+                                  on_drop=lambda item: pool.release(item[0])).start()
+        num_slots = pipeline.capacity + pipeline.batch_size + 1
+        if process_workers:
+            pool = ProcessFramePool(
+                target_size, num_slots + process_workers, num_workers=process_workers,
+                codec=compression if compression in IMAGE_CODECS else None,
+                on_result=pipeline.put, state_dim=STATE_DIM)
+        else:
+            pool = FramePool(frame_shape, num_slots, state_dim=STATE_DIM)
+            preprocess = FramePreprocessor(target_size)
+        scheduler = FrameScheduler(interval).start()
+        state = StateBlock(STATE_DIM)
+        state_row = np.zeros(STATE_DIM, dtype=np.float32)
+        grab_time = 0.0
+        lateness = []
+
+        with SyntheticCapture(width, height) as source:
+            if process_workers:
+                # 预先启动工作进程，不计入测试时间
+                pool.start(source.grab().shape)
+            start = time.perf_counter()
+            end = time.time() + duration
+            while True:
+                tick = scheduler.wait()
+                if tick.actual >= end:
+                    break
+                t = time.perf_counter()
+                src = source.grab()
+                if process_workers:
+                    pool.submit(src, state.snapshot(state_row), tick.actual, tick.scheduled)
+                else:
+                    slot = pool.acquire()
+                    preprocess(src, pool[slot])
+                    pipeline.put((slot, state.snapshot(pool.states[slot]), tick.actual, tick.scheduled, None))
+                grab_time += time.perf_counter() - t
+                lateness.append(tick.actual - tick.scheduled)
+
+        t = time.perf_counter()
+        if process_workers:
+            pool.stop()
+        pipeline.stop()
+        store.close()
+        if process_workers:
+            pool.close()
+        drain_time = time.perf_counter() - t
+        elapsed = time.perf_counter() - start
+        stats = pipeline.stats()
+        size = sum(os.path.getsize(f) for f in shard_files(path))
+
+    n = len(lateness)
+    result = {
+        'frames': n,
+        'written': stats['written'],
+        'dropped': stats['dropped'],
+        'max_depth': stats['max_depth'],
+        'skipped': scheduler.skipped,
+        'fps': stats['written'] / elapsed,
+        'capture_ms': grab_time / max(n, 1) * 1000,
+        'drain_ms': drain_time * 1000,
+        'write_mb_s': size / 1e6 / elapsed,
+        'file_mb': size / 1e6,
+        'lateness_ms': _percentiles(lateness),
+    }
+    if verbose:
+        if interval > 0:
+            _report(layout, n, duration, lateness, scheduler.skipped)
+        print(f"采集线程 {result['capture_ms']:.2f} ms/帧, 写入 {stats['written']} 帧 "
+              f"({result['fps']:.1f} FPS), 丢弃 {stats['dropped']} 帧, "
+              f"最大队列深度 {stats['max_depth']}, 收尾 {result['drain_ms']:.1f} ms, "
+              f"文件 {result['file_mb']:.1f} MB")
+    return result
+
+
+def bench_workers(duration=5.0, width=1920, height=1080, target_size=(1920, 1080),
+                  compression='jpeg', workers=(0, 1, 2, 4)):
+    """
+    不限速录制时，吞吐随工作进程数的变化
+    0 表示在采集线程中缩放、在写盘线程中编码
+    """
+    print(f"{width}x{height} -> {target_size[0]}x{target_size[1]}, 压缩 {compression}")
+    for n in workers:
+        result = bench_record(duration, width, height, target_size, interval=0,
+                              compression=compression, process_workers=n, verbose=False)
+        print(f"{n} 个工作进程: {result['fps']:.1f} FPS, 采集线程 {result['capture_ms']:.2f} ms/帧")
+
+
+def _measure(step, iterations):
+    """
+    测量单步耗时与临时内存峰值
+    :return: (每帧毫秒数, 每帧临时分配峰值字节数)
+    """
+    for _ in range(5):
+        step()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        step()
+    per_frame = (time.perf_counter() - start) / iterations * 1000
+
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    step()
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return per_frame, peak
+
+
+def bench_preprocess(width=1280, height=720, target_size=(1280, 720), iterations=200):
+    """
+    比较旧的 np.array + cvtColor + resize 路径与预分配缓冲区路径
+    模拟 mss 截图的 bytearray 缓冲区，并包含写入存储批缓冲区的一次复制
+    """
+    with SyntheticCapture(width, height) as source:
+        raw = bytearray(source.grab().tobytes())
+    frame_shape = (target_size[1], target_size[0], 3)
+    batch = np.empty((32,) + frame_shape, dtype=np.uint8)
+    counter = [0]
+
+    def old_path():
+        frame = np.array(np.frombuffer(raw, dtype=np.uint8).reshape(height, width, 4))
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
+        frame = cv2.resize(frame, target_size)
+        batch[counter[0] % 32] = frame
+        counter[0] += 1
+
+    pool = FramePool(frame_shape, 4)
+    preprocess = FramePreprocessor(target_size)
+
+    def new_path():
+        slot = pool.acquire()
+        view = np.frombuffer(raw, dtype=np.uint8).reshape(height, width, 4)
+        preprocess(view, pool[slot])
+        batch[counter[0] % 32] = pool[slot]
+        pool.release(slot)
+        counter[0] += 1
+
+    print(f"{width}x{height} -> {target_size[0]}x{target_size[1]}, {iterations} 次")
+    for name, step in (('old', old_path), ('zero-copy', new_path)):
+        per_frame, peak = _measure(step, iterations)
+        print(f"{name:>10}: {per_frame:.3f} ms/帧, 临时分配峰值 {peak / 1024:.1f} KB/帧")
+
+
+def _collect_frames(num_frames, width, height, target_size, source_path=None):
+    """
+    从合成画面源或已有录制文件取一批预处理后的画面
+    """
+    source = ReplayCapture(source_path) if source_path else SyntheticCapture(width, height)
+    frames = np.empty((num_frames, target_size[1], target_size[0], 3), dtype=np.uint8)
+    preprocess = FramePreprocessor(target_size)
+    with source:
+        for i in range(num_frames):
+            preprocess(source.grab(), frames[i])
+    return frames
+
+
+def bench_compression(num_frames=200, width=1280, height=720, target_size=(1280, 720),
+                      source_path=None, options=COMPRESSIONS):
+    """
+    比较各压缩方式的压缩率、编码耗时与解码耗时
+    编码耗时按写入整个文件的时间计算，包含 HDF5 写盘
+    """
+    frames = _collect_frames(num_frames, width, height, target_size, source_path)
+    raw_bytes = frames.nbytes
+    print(f"{num_frames} 帧 {target_size[0]}x{target_size[1]}, 原始大小 {raw_bytes / 1e6:.1f} MB")
+    state = np.zeros(STATE_DIM, dtype=np.float32)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for option in options:
+            path = os.path.join(tmp, f"{option}.h5")
+            start = time.perf_counter()
+            store = open_store(path, frames.shape[1:], STATE_DIM, compression=option)
+            for i, frame in enumerate(frames):
+                store.append(frame, state, float(i))
+            store.close()
+            encode = (time.perf_counter() - start) / num_frames * 1000
+            size = os.path.getsize(path)
+
+            start = time.perf_counter()
+            with h5py.File(path, 'r') as f:
+                read_frames(f['frames'])
+            decode = (time.perf_counter() - start) / num_frames * 1000
+            print(f"{option:>6}: 压缩率 {raw_bytes / size:6.2f}x, 文件 {size / 1e6:7.1f} MB, "
+                  f"编码 {encode:6.2f} ms/帧, 解码 {decode:6.2f} ms/帧")
+
+
+def _reset_peak_rss():
+    """
+    重置进程的内存峰值统计（Linux 的 /proc/self/clear_refs），不支持时忽略
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _peak_rss_mb():
+    """
+    自上次重置以来的常驻内存峰值（MB）
+    优先读取 /proc/self/status 的 VmHWM，否则使用进程生命周期内的 ru_maxrss，都不可用时返回 None
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _tracked(func, *args, **kwargs):
+    """
+    运行一项测试并在结果中附加常驻内存峰值
+    """
+    _reset_peak_rss()
+    result = func(*args, **kwargs)
+    result['peak_rss_mb'] = _peak_rss_mb()
+    return result
+
+
+def _tracked_list(func, *args, **kwargs):
+    """
+    运行返回列表的测试，每项附加整体的常驻内存峰值
+    """
+    _reset_peak_rss()
+    results = func(*args, **kwargs)
+    peak = _peak_rss_mb()
+    for result in results:
+        result['peak_rss_mb'] = peak
+    return results
+
+
+def bench_preprocess_sizes(width=1920, height=1080, target_sizes=((320, 240), (640, 480), (1280, 720)),
+                           iterations=200):
+    """
+    不同输出尺寸下缩放 + 去 alpha 的耗时
+    :return: 每个尺寸一个结果字典
+    """
+    with SyntheticCapture(width, height) as source:
+        src = source.grab().copy()
+    results = []
+    for target_size in target_sizes:
+        out = np.empty((target_size[1], target_size[0], 3), dtype=np.uint8)
+        preprocess = FramePreprocessor(target_size)
+        per_frame, peak = _measure(lambda: preprocess(src, out), iterations)
+        results.append({
+            'source': [width, height],
+            'target_size': list(target_size),
+            'ms_per_frame': per_frame,
+            'fps': 1000 / per_frame if per_frame > 0 else 0.0,
+            'alloc_bytes_per_frame': peak,
+        })
+    return results
+
+
+def bench_load(path, random_reads=500, chunk_size=256, seed=0):
+    """
+    录制文件的读取吞吐：顺序分块读取、随机单帧读取、load_gameplay_data 整体载入
+    :param path: 录制文件路径
+    :param random_reads: 随机读取的帧数
+    :param chunk_size: 顺序读取的块大小
+    :return: 结果字典
+    """
+    rng = np.random.default_rng(seed)
+    with Recording(path, chunk_size=chunk_size) as rec:
+        n = len(rec)
+        frame_bytes = int(np.prod(rec.frame_shape)) if rec.frame_shape else 0
+
+        start = time.perf_counter()
+        for frames, states in rec.iter_chunks():
+            if isinstance(frames, np.memmap):
+                # 映射视图在访问时才读盘，复制一次以计入读取开销
+                np.array(frames)
+        sequential = time.perf_counter() - start
+
+        indices = rng.integers(0, n, size=min(random_reads, n)) if n else []
+        start = time.perf_counter()
+        for i in indices:
+            frame, _ = rec[int(i)]
+            if isinstance(frame, np.memmap):
+                np.array(frame)
+        random_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    load_gameplay_data(path)
+    full = time.perf_counter() - start
+    return {
+        'frames': n,
+        'sequential_fps': n / sequential if sequential > 0 else 0.0,
+        'sequential_mb_s': n * frame_bytes / 1e6 / sequential if sequential > 0 else 0.0,
+        'random_fps': len(indices) / random_time if random_time > 0 else 0.0,
+        'random_ms': random_time / max(len(indices), 1) * 1000,
+        'full_load_s': full,
+    }
+
+
+def run_suite(duration=3.0, width=1920, height=1080, target_sizes=((320, 240), (640, 480), (1280, 720)),
+              record_size=(320, 240), layouts=tuple(STORES), compressions=COMPRESSIONS,
+              random_reads=500):
+    """
+    完整测试套件，全部使用合成画面，可以在无显示器的 Linux 上运行
+    包含：各输出尺寸的预处理耗时；各存储布局 x 压缩方式的不限速录制吞吐和文件读取吞吐；
+    每项附带常驻内存峰值。结果为可直接 json.dump 的字典，便于跟踪性能回退。
+    :return: 结果字典
+    """
+    results = {
+        'meta': {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'h5py': h5py.__version__,
+            'cpu_count': os.cpu_count(),
+            'duration': duration,
+            'source': [width, height],
+            'record_size': list(record_size),
+        },
+        'preprocess': _tracked_list(bench_preprocess_sizes, width, height, target_sizes),
+        'record': [],
+        'load': [],
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        for layout in layouts:
+            for compression in compressions:
+                if layout == 'legacy' and compression not in ('none',) + FILTERS:
+                    continue
+                if layout == 'memmap' and compression != 'none':
+                    continue
+                path = os.path.join(tmp, f"{layout}_{compression}.h5")
+                case = {'layout': layout, 'compression': compression}
+                record = _tracked(bench_record, duration, width, height, record_size, interval=0,
+                                  layout=layout, compression=compression, verbose=False,
+                                  out_path=path)
+                results['record'].append(dict(case, **record))
+                load = _tracked(bench_load, path, random_reads)
+                results['load'].append(dict(case, **load))
+                for f in shard_files(path):
+                    os.remove(f)
+                print(f"{layout:>10} {compression:>6}: 写入 {record['fps']:7.1f} FPS "
+                      f"{record['write_mb_s']:6.1f} MB/s, 顺序读 {load['sequential_fps']:8.1f} FPS, "
+                      f"随机读 {load['random_ms']:6.2f} ms/帧", file=sys.stderr)
+    return results
+
+
+def _parse_size(text):
+    """
+    解析 'WxH' 形式的尺寸
+    """
+    w, h = text.lower().split('x')
+    return int(w), int(h)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="录制管线性能测试")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('scheduler', help="采集调度帧率与抖动")
+    p.add_argument('--interval', type=float, default=0.05)
+    p.add_argument('--duration', type=float, default=5.0)
+    p.add_argument('--width', type=int, default=1280)
+    p.add_argument('--height', type=int, default=720)
+    p.add_argument('--work', type=float, default=0.01)
+    p.add_argument('--jitter', type=float, default=0.01)
+
+    p = sub.add_parser('record', help="端到端录制路径")
+    p.add_argument('--duration', type=float, default=5.0)
+    p.add_argument('--width', type=int, default=1280)
+    p.add_argument('--height', type=int, default=720)
+    p.add_argument('--target-size', type=int, nargs=2, default=(320, 240))
+    p.add_argument('--interval', type=float, default=0.05)
+    p.add_argument('--layout', choices=tuple(STORES), default='contiguous')
+    p.add_argument('--backpressure', choices=BACKPRESSURE_POLICIES, default='block')
+    p.add_argument('--compression', choices=COMPRESSIONS, default='none')
+    p.add_argument('--process-workers', type=int, default=0)
+
+    p = sub.add_parser('workers', help="吞吐随工作进程数的变化")
+    p.add_argument('--duration', type=float, default=5.0)
+    p.add_argument('--width', type=int, default=1920)
+    p.add_argument('--height', type=int, default=1080)
+    p.add_argument('--target-size', type=int, nargs=2, default=(1920, 1080))
+    p.add_argument('--compression', choices=COMPRESSIONS, default='jpeg')
+    p.add_argument('--workers', type=int, nargs='+', default=(0, 1, 2, 4))
+
+    p = sub.add_parser('preprocess', help="画面转换的耗时与内存分配")
+    p.add_argument('--width', type=int, default=1280)
+    p.add_argument('--height', type=int, default=720)
+    p.add_argument('--target-size', type=int, nargs=2, default=(1280, 720))
+    p.add_argument('--iterations', type=int, default=200)
+
+    p = sub.add_parser('compression', help="各压缩方式的压缩率与编解码耗时")
+    p.add_argument('--frames', type=int, default=200)
+    p.add_argument('--width', type=int, default=1280)
+    p.add_argument('--height', type=int, default=720)
+    p.add_argument('--target-size', type=int, nargs=2, default=(1280, 720))
+    p.add_argument('--source', default=None, help="使用已有录制文件作为画面源")
+    p.add_argument('--options', nargs='+', choices=COMPRESSIONS, default=COMPRESSIONS)
+
+    p = sub.add_parser('suite', help="完整测试套件，结果输出为 JSON")
+    p.add_argument('--duration', type=float, default=3.0, help="每个录制用例的时长（秒）")
+    p.add_argument('--width', type=int, default=1920)
+    p.add_argument('--height', type=int, default=1080)
+    p.add_argument('--target-sizes', type=_parse_size, nargs='+',
+                   default=[(320, 240), (640, 480), (1280, 720)], help="预处理输出尺寸，如 320x240")
+    p.add_argument('--record-size', type=_parse_size, default=(320, 240), help="录制用例的画面尺寸")
+    p.add_argument('--layouts', nargs='+', choices=tuple(STORES), default=tuple(STORES))
+    p.add_argument('--compressions', nargs='+', choices=COMPRESSIONS, default=COMPRESSIONS)
+    p.add_argument('--random-reads', type=int, default=500)
+    p.add_argument('--output', default=None, help="JSON 输出文件，默认打印到标准输出")
+
+    args = parser.parse_args()
+    if args.command == 'scheduler':
+        bench_scheduler(args.interval, args.duration, args.width, args.height,
+                        args.work, args.jitter)
+    elif args.command == 'record':
+        bench_record(args.duration, args.width, args.height, tuple(args.target_size),
+                     args.interval, args.layout, args.backpressure,
+                     args.compression, args.process_workers)
+    elif args.command == 'workers':
+        bench_workers(args.duration, args.width, args.height, tuple(args.target_size),
+                      args.compression, args.workers)
+    elif args.command == 'preprocess':
+        bench_preprocess(args.width, args.height, tuple(args.target_size), args.iterations)
+    elif args.command == 'compression':
+        bench_compression(args.frames, args.width, args.height, tuple(args.target_size),
+                          args.source, args.options)
+    elif args.command == 'suite':
+        results = run_suite(args.duration, args.width, args.height, args.target_sizes,
+                            args.record_size, args.layouts, args.compressions, args.random_reads)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+            print(f"结果已写入 {args.output}")
+        else:
+            print(json.dumps(results, ensure_ascii=False, indent=2))
@@ -0,0 +1,238 @@
+import time
+
+import cv2
+import h5py
+import numpy as np
+
+from codec import FrameDecoder
+from preprocess import screenshot_view
+from storage import MemmapFrameStore, open_memmap_arrays
+
+
+class CaptureBackend:
+    """
+    画面采集后端接口
+    grab() 返回 (H, W, C) 的 uint8 BGR/BGRA 画面，C 为 3 或 4。
+    返回的数组可能与后端内部缓冲区共享内存，只保证在下一次 grab() 之前有效。
+    """
+
+    def open(self):
+        """
+        打开采集资源
+        """
+        pass
+
+    def close(self):
+        """
+        释放采集资源
+        """
+        pass
+
+    def grab(self):
+        """
+        采集一帧画面
+        :return: (H, W, C) uint8 数组
+        """
+        raise NotImplementedError
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class MssCapture(CaptureBackend):
+    """
+    基于 mss 的屏幕采集，可通过 win32gui 定位指定窗口
+    """
+
+    def __init__(self, window_title=None, window_size=(1920, 1080)):
+        """
+        :param window_title: 游戏窗口标题，如果为None则录制全屏
+        :param window_size: 找不到窗口时使用的录制区域大小
+        """
+        self.window_title = window_title
+        self.window_size = window_size
+        self.rect = None
+        self._sct = None
+
+    def get_window_rect(self):
+        """
+        获取窗口位置和大小
+        :return: 包含窗口位置和大小的字典
+        """
+        if self.window_title:
+            try:
+                import win32gui
+            except ImportError:
+                win32gui = None
+            hwnd = win32gui.FindWindow(None, self.window_title) if win32gui else 0
+            if hwnd:
+                rect = win32gui.GetWindowRect(hwnd)
+                return {
+                    'top': rect[1],
+                    'left': rect[0],
+                    'width': rect[2] - rect[0],
+                    'height': rect[3] - rect[1]
+                }
+        # 如果没有指定窗口或找不到窗口，则从左上角录制 window_size 大小的区域
+        return {
+            'top': 0,
+            'left': 0,
+            'width': self.window_size[0],
+            'height': self.window_size[1]
+        }
+
+    def open(self):
+        import mss
+        self._sct = mss.mss()
+        self.rect = self.get_window_rect()
+
+    def close(self):
+        if self._sct is not None:
+            self._sct.close()
+            self._sct = None
+
+    def grab(self):
+        return screenshot_view(self._sct.grab(self.rect))
+
+
+class SyntheticCapture(CaptureBackend):
+    """
+    合成画面源，不依赖显示器，用于性能测试
+    生成带移动色块的 BGRA 画面；背景由低分辨率噪声放大得到，
+    平滑程度接近游戏画面，便于评估压缩效果。
+    指定 fps 时按该帧率产生新画面，调用快于帧率时会等待下一帧。
+    """
+
+    def __init__(self, width=1280, height=720, fps=None, num_patterns=8, seed=0):
+        """
+        :param width: 画面宽度
+        :param height: 画面高度
+        :param fps: 画面源帧率，None 表示每次调用都立即返回新画面
+        :param num_patterns: 预生成的背景数量
+        :param seed: 随机种子
+        """
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.num_patterns = num_patterns
+        self.seed = seed
+        self.rect = {'top': 0, 'left': 0, 'width': width, 'height': height}
+        self.frame_index = 0
+        self._patterns = None
+        self._buf = None
+        self._next_time = None
+
+    def open(self):
+        rng = np.random.default_rng(self.seed)
+        self._patterns = np.empty((self.num_patterns, self.height, self.width, 4), dtype=np.uint8)
+        small = (max(1, self.height // 16), max(1, self.width // 16), 4)
+        for i in range(self.num_patterns):
+            noise = rng.integers(0, 256, small, dtype=np.uint8)
+            cv2.resize(noise, (self.width, self.height), dst=self._patterns[i],
+                       interpolation=cv2.INTER_CUBIC)
+        self._buf = np.empty((self.height, self.width, 4), dtype=np.uint8)
+        self.frame_index = 0
+        self._next_time = time.perf_counter()
+
+    def close(self):
+        self._patterns = None
+        self._buf = None
+
+    def grab(self):
+        if self.fps:
+            delay = self._next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self._next_time = max(self._next_time + 1.0 / self.fps, time.perf_counter())
+
+        i = self.frame_index
+        np.copyto(self._buf, self._patterns[i % self.num_patterns])
+        # 画一个水平移动的色块，使相邻帧有连续变化
+        size = max(1, min(self.width, self.height) // 8)
+        x = (i * 8) % max(1, self.width - size)
+        y = (self.height - size) // 2
+        self._buf[y:y + size, x:x + size] = (0, 0, 255, 255)
+        self.frame_index += 1
+        return self._buf
+
+
+class ReplayCapture(CaptureBackend):
+    """
+    回放已有录制文件作为画面源，支持逐帧布局、连续布局和内存映射布局
+    """
+
+    def __init__(self, h5_path, loop=True):
+        """
+        :param h5_path: HDF5文件路径
+        :param loop: 播放到结尾后是否从头循环
+        """
+        self.h5_path = h5_path
+        self.loop = loop
+        self.rect = None
+        self.frame_index = 0
+        self._h5file = None
+        self._count = 0
+        self._keys = None
+        self._rows = None
+        self._mapped = None
+        self._decoder = None
+        self._buf = None
+
+    def open(self):
+        self._h5file = h5py.File(self.h5_path, 'r')
+        self._mapped = None
+        if self._h5file.attrs.get('layout') == MemmapFrameStore.layout:
+            self._mapped, _ = open_memmap_arrays(self.h5_path, self._h5file, mode='r')
+            self._keys = None
+            self._rows = None
+            self._count = len(self._mapped)
+            shape = tuple(int(v) for v in self._h5file.attrs['frame_shape'])
+        elif 'frames' in self._h5file:
+            frames = self._h5file['frames']
+            self._keys = None
+            # 去重录制按 frame_index 展开重复帧
+            self._rows = self._h5file['frame_index'][:] if 'frame_index' in self._h5file else None
+            self._count = frames.shape[0] if self._rows is None else len(self._rows)
+            self._decoder = FrameDecoder(frames)
+            shape = self._decoder.frame_shape
+        else:
+            self._keys = sorted([k for k in self._h5file.keys() if k.endswith('_x')],
+                                key=lambda x: int(x.split('_')[1]))
+            self._count = len(self._keys)
+            shape = self._h5file[self._keys[0]].shape if self._keys else (0, 0)
+        self.rect = {'top': 0, 'left': 0, 'width': shape[1], 'height': shape[0]}
+        self.frame_index = 0
+        if self._keys is None:
+            self._buf = np.empty(shape, dtype=np.uint8)
+
+    def close(self):
+        if self._h5file is not None:
+            self._h5file.close()
+            self._h5file = None
+        self._mapped = None
+        self._buf = None
+
+    def grab(self):
+        if self._h5file is None:
+            raise RuntimeError(f"回放文件未打开, 请先调用 open(): {self.h5_path}")
+        if self.frame_index >= self._count:
+            if not self.loop or self._count == 0:
+                raise EOFError("回放结束")
+            self.frame_index = 0
+        i = self.frame_index
+        self.frame_index += 1
+        if self._mapped is not None:
+            return self._mapped[i]
+        if self._keys is None:
+            frames = self._h5file['frames']
+            if self._rows is not None:
+                i = int(self._rows[i])
+            if self._decoder.encoded:
+                return self._decoder.read(i)
+            frames.read_direct(self._buf, np.s_[i])
+            return self._buf
+        return self._h5file[self._keys[i]][:]
@@ -0,0 +1,267 @@
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+import cv2
+import numpy as np
+
+# HDF5 分块过滤器，对整个 frames 数据集生效
+FILTERS = ('gzip', 'lzf')
+# 逐帧图像编码，结果存为变长字节数据集
+IMAGE_CODECS = {
+    'jpeg': ('.jpg', cv2.IMWRITE_JPEG_QUALITY),
+    'webp': ('.webp', cv2.IMWRITE_WEBP_QUALITY),
+    'png': ('.png', None),
+}
+# 关键帧 + 帧间异或差分，zlib 压缩后存为变长字节数据集
+DELTA = 'delta'
+COMPRESSIONS = ('none',) + FILTERS + tuple(IMAGE_CODECS) + (DELTA,)
+
+# 差分编码每帧首字节的类型标记
+_KEYFRAME = 0
+_DELTAFRAME = 1
+
+
+def encode_frame(frame, codec, quality=90):
+    """
+    用 cv2.imencode 编码单帧
+    :param frame: (H, W, 3) BGR 画面
+    :param codec: 'jpeg' / 'webp' / 'png'
+    :param quality: jpeg/webp 质量 (0-100)
+    :return: 一维 uint8 数组
+    """
+    ext, flag = IMAGE_CODECS[codec]
+    params = [flag, int(quality)] if flag is not None else []
+    ok, buf = cv2.imencode(ext, frame, params)
+    if not ok:
+        raise ValueError(f"{codec} 编码失败")
+    return buf.reshape(-1)
+
+
+def decode_frame(buf):
+    """
+    解码单帧
+    :param buf: encode_frame 的结果
+    :return: (H, W, 3) BGR 画面
+    """
+    return cv2.imdecode(np.asarray(buf, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def is_encoded(dataset):
+    """
+    判断 frames 数据集是否为逐帧编码（图像编码或差分编码）
+    """
+    codec = dataset.attrs.get('codec', 'none')
+    return codec in IMAGE_CODECS or codec == DELTA
+
+
+def read_frames(dataset, start=0, stop=None):
+    """
+    从 frames 数据集读取一段画面，编码数据会自动解码
+    :param dataset: frames 数据集
+    :param start: 起始帧
+    :param stop: 结束帧（不含），None 表示到结尾
+    :return: (N, H, W, 3) 数组
+    """
+    if not is_encoded(dataset):
+        return dataset[start:stop]
+    if dataset.attrs['codec'] == DELTA:
+        return FrameDecoder(dataset).read_range(start, stop)
+    encoded = dataset[start:stop]
+    shape = tuple(dataset.attrs['frame_shape'])
+    frames = np.empty((len(encoded),) + shape, dtype=np.uint8)
+    for i, buf in enumerate(encoded):
+        frames[i] = decode_frame(buf)
+    return frames
+
+
+def read_frame(dataset, index):
+    """
+    读取单帧画面，编码数据会自动解码
+    """
+    if dataset.attrs.get('codec') == DELTA:
+        return FrameDecoder(dataset).read(index)
+    if is_encoded(dataset):
+        return decode_frame(dataset[index])
+    return dataset[index]
+
+
+class EncoderPool:
+    """
+    逐帧编码线程池
+    cv2.imencode 执行时会释放 GIL，多个线程可以并行编码
+    """
+
+    def __init__(self, codec, quality=90, num_workers=2):
+        """
+        :param codec: 'jpeg' / 'webp' / 'png'
+        :param quality: 编码质量
+        :param num_workers: 编码线程数
+        """
+        if codec not in IMAGE_CODECS:
+            raise ValueError(f"未知的图像编码: {codec}")
+        self.codec = codec
+        self.quality = quality
+        self._executor = ThreadPoolExecutor(max_workers=num_workers,
+                                            thread_name_prefix='encoder')
+
+    def _encode(self, frame):
+        return encode_frame(frame, self.codec, self.quality)
+
+    def encode_batch(self, frames):
+        """
+        并行编码一批画面
+        :param frames: 画面序列
+        :return: 与输入顺序一致的编码结果 object 数组
+        """
+        result = np.empty(len(frames), dtype=object)
+        for i, buf in enumerate(self._executor.map(self._encode, frames)):
+            result[i] = buf
+        return result
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+class DeltaEncoder:
+    """
+    关键帧 + 差分编码器
+    每 keyframe_interval 帧存一个完整的关键帧，其余帧存与前一帧的按位异或，
+    画面不变的区域异或结果为 0，zlib 压缩后体积很小。
+    异或必须按顺序计算，zlib 压缩会释放 GIL，在线程池中并行执行。
+    接口与 EncoderPool 相同；编码器保存上一帧，必须按帧顺序调用。
+    """
+
+    def __init__(self, keyframe_interval=30, level=1, num_workers=2):
+        """
+        :param keyframe_interval: 关键帧间隔 K，随机读取任一帧最多解码 K 帧
+        :param level: zlib 压缩级别
+        :param num_workers: 压缩线程数
+        """
+        self.keyframe_interval = keyframe_interval
+        self.level = level
+        self.count = 0
+        self._prev = None
+        self._saved = (0, None)
+        self._executor = ThreadPoolExecutor(max_workers=num_workers,
+                                            thread_name_prefix='encoder')
+
+    def _compress(self, item):
+        kind, data = item
+        return np.frombuffer(bytes([kind]) + zlib.compress(data, self.level), dtype=np.uint8)
+
+    def encode_batch(self, frames):
+        """
+        编码紧接在上一批之后的一批画面
+        :param frames: 画面序列，调用返回前不能被修改
+        :return: 与输入顺序一致的编码结果 object 数组
+        """
+        # 保存批开始前的状态，写盘失败时用 rollback() 恢复
+        self._saved = (self.count, None if self._prev is None else self._prev.copy())
+        items = []
+        for frame in frames:
+            if self.count % self.keyframe_interval == 0:
+                items.append((_KEYFRAME, np.ascontiguousarray(frame)))
+            else:
+                items.append((_DELTAFRAME, np.bitwise_xor(frame, self._prev)))
+            if self._prev is None:
+                self._prev = np.empty_like(frame)
+            np.copyto(self._prev, frame)
+            self.count += 1
+        result = np.empty(len(items), dtype=object)
+        for i, buf in enumerate(self._executor.map(self._compress, items)):
+            result[i] = buf
+        return result
+
+    def rollback(self):
+        """
+        撤销最近一次 encode_batch，下一批从那一批的第一帧位置重新编码
+        """
+        self.count, self._prev = self._saved
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+class FrameDecoder:
+    """
+    frames 数据集的读取器，支持所有存储方式
+    差分编码时从最近的关键帧开始依次还原，最多解码 K 帧；
+    最近解码的若干个关键帧和最后一次解码到的帧会被缓存，
+    顺序读取时每帧只需解一个差分。可以被多个线程共用。
+    """
+
+    def __init__(self, dataset, cache_size=8):
+        """
+        :param dataset: frames 数据集
+        :param cache_size: 缓存的关键帧数量
+        """
+        self.dataset = dataset
+        self.codec = dataset.attrs.get('codec', 'none')
+        self.encoded = is_encoded(dataset)
+        self.frame_shape = tuple(dataset.attrs['frame_shape']) if self.encoded else dataset.shape[1:]
+        self.keyframe_interval = int(dataset.attrs.get('keyframe_interval', 1))
+        self.cache_size = cache_size
+        self._keyframes = OrderedDict()
+        self._last = None
+        self._lock = Lock()
+
+    def __len__(self):
+        return self.dataset.shape[0]
+
+    def read(self, index):
+        """
+        读取单帧
+        :return: (H, W, 3) 画面
+        """
+        if self.codec != DELTA:
+            return read_frame(self.dataset, index)
+        return self.read_range(index, index + 1)[0]
+
+    def read_range(self, start, stop):
+        """
+        读取 [start, stop) 的画面
+        :param start: 起始帧，None 表示从头开始
+        :param stop: 结束帧（不含），None 表示到结尾
+        :return: (N, H, W, 3) 数组
+        """
+        if self.codec != DELTA:
+            return read_frames(self.dataset, start, stop)
+        start = 0 if start is None else start
+        stop = len(self) if stop is None else min(stop, len(self))
+        out = np.empty((max(0, stop - start),) + self.frame_shape, dtype=np.uint8)
+        if len(out) == 0:
+            return out
+        with self._lock:
+            key = start - start % self.keyframe_interval
+            if self._last is not None and key <= self._last[0] <= start:
+                # 从上次解码到的位置继续
+                begin, cur = self._last
+                if begin == start:
+                    out[0] = cur
+                begin += 1
+            elif key in self._keyframes:
+                self._keyframes.move_to_end(key)
+                cur = self._keyframes[key].copy()
+                if key == start:
+                    out[0] = cur
+                begin = key + 1
+            else:
+                begin, cur = key, None
+            # 解码中途出错时不能留下不完整的位置
+            self._last = None
+            for i, buf in enumerate(self.dataset[begin:stop], begin):
+                buf = np.asarray(buf, dtype=np.uint8)
+                data = np.frombuffer(zlib.decompress(buf[1:]), dtype=np.uint8).reshape(self.frame_shape)
+                if buf[0] == _KEYFRAME:
+                    cur = data.copy()
+                    self._keyframes[i] = data
+                    while len(self._keyframes) > self.cache_size:
+                        self._keyframes.popitem(last=False)
+                else:
+                    np.bitwise_xor(cur, data, out=cur)
+                if i >= start:
+                    out[i - start] = cur
+            self._last = (stop - 1, cur)
+        return out
@@ -0,0 +1,516 @@
+import os
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from glob import glob
+from threading import Lock
+
+import h5py
+import numpy as np
+
+from codec import FrameDecoder
+from geometry import SCREEN, read_geometry, transform_states
+from manifest import SessionManifest
+from storage import MemmapFrameStore, open_memmap_arrays
+
+
+class FrameSequence:
+    """
+    录制文件画面的惰性序列视图，支持 len() 和下标/切片访问
+    可以直接传给 visualize_recording 等按帧索引的函数
+    """
+
+    def __init__(self, recording):
+        self._recording = recording
+
+    def __len__(self):
+        return len(self._recording)
+
+    def __getitem__(self, index):
+        return self._recording.read_frames(index)
+
+
+class Recording:
+    """
+    惰性读取的录制文件，兼容逐帧布局、连续布局和内存映射布局
+    rec[i] 返回 (frame, state)，rec[a:b] 返回 (frames, states)，只读取请求的帧；
+    迭代时按 chunk_size 分块读取，内存中最多保留一个块。
+    geometry 为文件记录的采集区域和屏幕到画面的坐标变换（旧文件按 1920x1080 全屏推算），
+    positions 指定读取状态时鼠标位置/速度使用的坐标系，见 geometry.transform_states。
+    去重录制（带 frame_index 数据集）的重复帧在读取时按行号展开，与未去重的文件用法相同。
+    内存映射布局的画面和状态以写时复制方式映射，切片读取返回映射视图而不复制数据。
+
+    用法:
+        with Recording(path) as rec:
+            frame, state = rec[100]
+            for frames, states in rec.iter_chunks():
+                ...
+    """
+
+    def __init__(self, h5_path, chunk_size=256, positions=SCREEN):
+        """
+        :param h5_path: HDF5文件路径
+        :param chunk_size: 迭代时每块读取的帧数
+        :param positions: 鼠标坐标系 'screen' / 'frame' / 'normalized'
+        """
+        self.path = h5_path
+        self.chunk_size = chunk_size
+        self.positions = positions
+        self.h5file = h5py.File(h5_path, 'r')
+        if self.h5file.attrs.get('layout') == MemmapFrameStore.layout:
+            self.layout = MemmapFrameStore.layout
+            self._frames, self._states = open_memmap_arrays(h5_path, self.h5file)
+            self._frame_index = None
+            self._decoder = None
+            self._length = self._states.shape[0]
+            self.frame_shape = self._frames.shape[1:]
+            self.state_dim = self._states.shape[1]
+        elif 'frames' in self.h5file:
+            self.layout = 'contiguous'
+            self._frames = self.h5file['frames']
+            self._states = self.h5file['states']
+            self._frame_index = self.h5file.get('frame_index')
+            # 差分编码时解码器缓存关键帧，顺序读取每帧只解一个差分
+            self._decoder = FrameDecoder(self._frames)
+            self._length = self._states.shape[0]
+            if 'frame_count' in self.h5file.attrs:
+                # 只读取最后一次完整写入的批次，未正常关闭的文件末尾可能有未写完的行
+                self._length = min(self._length, int(self.h5file.attrs['frame_count']))
+            self.frame_shape = self._decoder.frame_shape
+            self.state_dim = self._states.shape[1]
+        else:
+            # 逐帧布局的帧号从0连续递增，每帧两个数据集，无需排序键名
+            self.layout = 'legacy'
+            self._frames = None
+            self._states = None
+            self._frame_index = None
+            self._decoder = None
+            self._length = len(self.h5file) // 2
+            if self._length:
+                self.frame_shape = self.h5file['frame_0_x'].shape
+                self.state_dim = self.h5file['frame_0_y'].shape[0]
+            else:
+                self.frame_shape = None
+                self.state_dim = None
+        self.geometry = read_geometry(self.h5file.attrs, self.frame_shape)
+        self._all_states = None
+
+    def __len__(self):
+        return self._length
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        if self.h5file is not None:
+            self.h5file.close()
+            self.h5file = None
+        self._frames = None
+        self._states = None
+
+    @property
+    def frames(self):
+        """
+        画面的惰性序列视图
+        """
+        return FrameSequence(self)
+
+    @property
+    def states(self):
+        """
+        全部状态数组 (N, D)，首次访问时读取并缓存，体积远小于画面
+        """
+        if self._all_states is None:
+            self._all_states = self.read_states(slice(None))
+        return self._all_states
+
+    @property
+    def timestamps(self):
+        """
+        实际采集时间 (N,)，逐帧布局没有时间戳时返回 None
+        与画面和状态一样截取到 len(self)，未正常关闭的文件中时间戳可能比帧多
+        """
+        if 'timestamps' in self.h5file:
+            return self.h5file['timestamps'][:self._length]
+        return None
+
+    def _normalize(self, index):
+        """
+        把整数下标转换为非负下标，越界时抛出 IndexError
+        """
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError(f"帧下标越界: {index}")
+        return index
+
+    def read_frames(self, index):
+        """
+        读取画面
+        :param index: 整数下标或切片
+        :return: 单帧 (H, W, 3) 或 (N, H, W, 3)
+        """
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._length)
+            if self.layout == MemmapFrameStore.layout:
+                return self._frames[start:stop:step]
+            if step != 1:
+                indices = range(start, stop, step)
+                out = np.empty((len(indices),) + self.frame_shape, dtype=np.uint8)
+                for j, i in enumerate(indices):
+                    out[j] = self.read_frames(i)
+                return out
+            if self.layout == 'contiguous':
+                if self._frame_index is None:
+                    return self._decoder.read_range(start, stop)
+                # 行号单调不减，读取覆盖的保存帧区间后按行号展开
+                rows = self._frame_index[start:stop]
+                if len(rows) == 0:
+                    return np.empty((0,) + self.frame_shape, dtype=np.uint8)
+                stored = self._decoder.read_range(int(rows[0]), int(rows[-1]) + 1)
+                return stored[rows - rows[0]]
+            out = np.empty((max(0, stop - start),) + self.frame_shape, dtype=np.uint8)
+            for j, i in enumerate(range(start, stop)):
+                self.h5file[f'frame_{i}_x'].read_direct(out, dest_sel=np.s_[j])
+            return out
+        index = self._normalize(index)
+        if self.layout == MemmapFrameStore.layout:
+            return self._frames[index]
+        if self.layout == 'contiguous':
+            if self._frame_index is not None:
+                index = int(self._frame_index[index])
+            return self._decoder.read(index)
+        return self.h5file[f'frame_{index}_x'][:]
+
+    def read_states(self, index):
+        """
+        读取状态，鼠标位置/速度按 positions 指定的坐标系转换
+        :param index: 整数下标或切片
+        :return: (D,) 或 (N, D)
+        """
+        states = self._read_states(index)
+        if self.positions == SCREEN or self.geometry is None:
+            return states
+        return transform_states(states, self.geometry['screen_to_frame'],
+                                self.geometry['target_size'], self.positions)
+
+    def _read_states(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._length)
+            if self._states is not None:
+                return self._states[start:stop:step]
+            out = np.empty((len(range(start, stop, step)), self.state_dim), dtype=np.float32)
+            for j, i in enumerate(range(start, stop, step)):
+                out[j] = self.h5file[f'frame_{i}_y'][:]
+            return out
+        index = self._normalize(index)
+        if self._states is not None:
+            return self._states[index]
+        return self.h5file[f'frame_{index}_y'][:]
+
+    def __getitem__(self, index):
+        return self.read_frames(index), self.read_states(index)
+
+    def iter_chunks(self, start=0, stop=None, chunk_size=None):
+        """
+        分块迭代画面和状态
+        :param start: 起始帧
+        :param stop: 结束帧（不含），None 表示到结尾
+        :param chunk_size: 每块帧数，None 使用构造时的设置
+        :return: 依次产生 (frames, states)
+        """
+        chunk_size = chunk_size or self.chunk_size
+        stop = self._length if stop is None else min(stop, self._length)
+        for i in range(start, stop, chunk_size):
+            j = min(i + chunk_size, stop)
+            yield self[i:j]
+
+    def __iter__(self):
+        """
+        逐帧迭代 (frame, state)，底层按块读取
+        """
+        for frames, states in self.iter_chunks():
+            for frame, state in zip(frames, states):
+                yield frame, state
+
+
+def find_shards(paths):
+    """
+    展开录制分片路径
+    :param paths: 单个或多个路径，可以是 .h5 文件、会话目录或通配符
+    :return: 按文件名排序的分片路径列表（分片名带时间戳，排序即时间顺序）
+    """
+    return [path for path, _ in _resolve_shards(paths)]
+
+
+def _resolve_shards(paths):
+    """
+    展开录制分片路径，并尽量从会话清单中取得帧数
+    :return: (分片路径, 帧数) 列表，帧数未知时为 None
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    shards = []
+    for path in paths:
+        if os.path.isdir(path) and SessionManifest.exists(path):
+            # 有清单时直接使用，不需要列目录或打开分片
+            manifest = SessionManifest.load(path)
+            shards.extend((p, s['frames']) for p, s in zip(manifest.shard_paths(), manifest.shards)
+                          if s['frames'] > 0)
+        elif os.path.isdir(path):
+            shards.extend((p, None) for p in sorted(glob(os.path.join(path, '*.h5'))))
+        elif any(c in path for c in '*?['):
+            shards.extend((p, None) for p in sorted(glob(path)))
+        else:
+            shards.append((path, None))
+    return shards
+
+
+class ShardedDataset:
+    """
+    跨多个分片/会话的训练数据集，接口与 PyTorch Dataset 一致（__len__ / __getitem__），
+    可以直接交给 torch.utils.data.DataLoader，也可以配合 PrefetchLoader 使用。
+
+    window=K 时第 i 个样本为长度 K 的 (frames, states) 序列窗口，窗口不跨分片；
+    window=1 时样本为单帧 (frame, state)。
+    读取按 chunk_size 分块进行，最近使用的 cache_size 个块缓存在内存中。
+    会话目录中有 manifest.json 时，分片列表和帧数直接取自清单。
+    文件句柄在每个进程中按需打开，数据集对象可以安全地传给子进程。
+    """
+
+    def __init__(self, paths, window=1, stride=1, chunk_size=64, cache_size=16, positions=SCREEN):
+        """
+        :param paths: 分片路径、会话目录或通配符，或它们的列表
+        :param window: 每个样本的帧数 K
+        :param stride: 相邻窗口起点的间隔
+        :param chunk_size: 每次从磁盘读取的帧数
+        :param cache_size: 缓存的块数
+        :param positions: 鼠标坐标系 'screen' / 'frame' / 'normalized'
+        """
+        entries = _resolve_shards(paths)
+        self.shards = [path for path, _ in entries]
+        self.window = window
+        self.stride = stride
+        self.chunk_size = chunk_size
+        self.cache_size = cache_size
+        self.positions = positions
+
+        self.lengths = np.array([n if n is not None else self._probe_length(p)
+                                 for p, n in entries], dtype=np.int64)
+        # 每个分片第一帧的全局帧号
+        self.offsets = np.concatenate([[0], np.cumsum(self.lengths)])
+        # 每个分片第一个窗口的全局样本号
+        counts = np.maximum(0, (self.lengths - window) // stride + 1)
+        self.window_offsets = np.concatenate([[0], np.cumsum(counts)])
+
+        self._init_handles()
+
+    @staticmethod
+    def _probe_length(path):
+        with Recording(path) as rec:
+            return len(rec)
+
+    def _init_handles(self):
+        self._pid = os.getpid()
+        self._recordings = {}
+        self._cache = OrderedDict()
+        self._lock = Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ('_recordings', '_cache', '_lock'):
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_handles()
+
+    def __len__(self):
+        return int(self.window_offsets[-1])
+
+    @property
+    def num_frames(self):
+        """
+        所有分片的总帧数
+        """
+        return int(self.offsets[-1])
+
+    def locate(self, frame_index):
+        """
+        全局帧号转换为 (分片序号, 分片内帧号)
+        """
+        if frame_index < 0:
+            frame_index += self.num_frames
+        if not 0 <= frame_index < self.num_frames:
+            raise IndexError(f"帧下标越界: {frame_index}")
+        shard = int(np.searchsorted(self.offsets, frame_index, side='right') - 1)
+        return shard, int(frame_index - self.offsets[shard])
+
+    def _recording(self, shard):
+        if self._pid != os.getpid():
+            # fork 出的子进程不能复用父进程的 HDF5 句柄
+            self._init_handles()
+        # 在锁内打开，避免多个线程同时打开同一分片、多出的句柄无人关闭
+        with self._lock:
+            rec = self._recordings.get(shard)
+            if rec is None:
+                rec = Recording(self.shards[shard], positions=self.positions)
+                self._recordings[shard] = rec
+        return rec
+
+    def _chunk(self, shard, chunk):
+        """
+        读取一个块，优先从缓存中取
+        """
+        key = (shard, chunk)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        start = chunk * self.chunk_size
+        data = self._recording(shard)[start:start + self.chunk_size]
+        with self._lock:
+            self._cache[key] = data
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return data
+
+    def read(self, shard, start, stop):
+        """
+        读取分片内 [start, stop) 的画面和状态
+        :return: (frames, states)
+        """
+        rec = self._recording(shard)
+        if rec.layout == MemmapFrameStore.layout:
+            # 映射视图不经过块缓存
+            return rec[start:stop]
+        first = start // self.chunk_size
+        last = (stop - 1) // self.chunk_size
+        if first == last:
+            frames, states = self._chunk(shard, first)
+            lo = start - first * self.chunk_size
+            return frames[lo:lo + stop - start], states[lo:lo + stop - start]
+        parts = []
+        for chunk in range(first, last + 1):
+            base = chunk * self.chunk_size
+            frames, states = self._chunk(shard, chunk)
+            lo = max(start, base) - base
+            hi = min(stop, base + len(frames)) - base
+            parts.append((frames[lo:hi], states[lo:hi]))
+        return (np.concatenate([p[0] for p in parts]),
+                np.concatenate([p[1] for p in parts]))
+
+    def frame(self, frame_index):
+        """
+        按全局帧号读取单帧
+        :return: (frame, state)
+        """
+        shard, local = self.locate(frame_index)
+        frames, states = self.read(shard, local, local + 1)
+        return frames[0], states[0]
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"样本下标越界: {index}")
+        shard = int(np.searchsorted(self.window_offsets, index, side='right') - 1)
+        start = int(index - self.window_offsets[shard]) * self.stride
+        frames, states = self.read(shard, start, start + self.window)
+        if self.window == 1:
+            return frames[0], states[0]
+        return frames, states
+
+    def close(self):
+        with self._lock:
+            for rec in self._recordings.values():
+                rec.close()
+            self._recordings = {}
+            self._cache.clear()
+
+
+# 进程池工作进程中的数据集实例
+_worker_dataset = None
+
+
+def _init_worker(dataset):
+    global _worker_dataset
+    _worker_dataset = dataset
+
+
+def _load_batch(indices, dataset=None):
+    """
+    读取一批样本并堆叠
+    :return: (frames, states)
+    """
+    dataset = dataset if dataset is not None else _worker_dataset
+    samples = [dataset[int(i)] for i in indices]
+    return (np.stack([s[0] for s in samples]),
+            np.stack([s[1] for s in samples]))
+
+
+class PrefetchLoader:
+    """
+    多工作者预取读取器
+    工作者并行读取/解码后续批次，主线程按顺序取用，读盘与训练重叠。
+    默认使用线程（HDF5 读取会持有 h5py 的全局锁，但解码等部分可以并行）；
+    use_processes=True 时每个工作进程打开自己的文件句柄，读取完全并行。
+    """
+
+    def __init__(self, dataset, batch_size=32, shuffle=False, num_workers=4, prefetch=2,
+                 use_processes=False, drop_last=False, seed=None):
+        """
+        :param dataset: ShardedDataset 或任何实现 __len__/__getitem__ 的数据集
+        :param batch_size: 每批样本数
+        :param shuffle: 每轮是否打乱样本顺序
+        :param num_workers: 工作者数量
+        :param prefetch: 每个工作者预取的批次数
+        :param use_processes: 是否使用进程池
+        :param drop_last: 是否丢弃最后不足一批的样本
+        :param seed: 打乱顺序的随机种子
+        """
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.num_workers = num_workers
+        self.prefetch = prefetch
+        self.use_processes = use_processes
+        self.drop_last = drop_last
+        self._rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        n = len(self.dataset)
+        if self.drop_last:
+            return n // self.batch_size
+        return (n + self.batch_size - 1) // self.batch_size
+
+    def _batches(self):
+        n = len(self.dataset)
+        order = self._rng.permutation(n) if self.shuffle else np.arange(n)
+        for i in range(0, len(self) * self.batch_size, self.batch_size):
+            yield order[i:i + self.batch_size]
+
+    def __iter__(self):
+        if self.use_processes:
+            executor = ProcessPoolExecutor(self.num_workers, initializer=_init_worker,
+                                           initargs=(self.dataset,))
+            load = _load_batch
+        else:
+            executor = ThreadPoolExecutor(self.num_workers)
+            load = lambda indices: _load_batch(indices, self.dataset)
+
+        in_flight = deque()
+        try:
+            for indices in self._batches():
+                in_flight.append(executor.submit(load, indices))
+                if len(in_flight) >= self.num_workers * self.prefetch:
+                    yield in_flight.popleft().result()
+            while in_flight:
+                yield in_flight.popleft().result()
+        finally:
+            for future in in_flight:
+                future.cancel()
+            executor.shutdown(wait=True)
@@ -0,0 +1,155 @@
+import argparse
+import multiprocessing as mp
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from dataset import Recording
+from view import overlay_geometry, draw_overlay_at
+
+
+def _estimate_fps(timestamps, default=30.0):
+    """
+    由采集时间戳估计帧率，没有时间戳时返回默认值
+    """
+    if timestamps is None or len(timestamps) < 2:
+        return default
+    interval = float(np.median(np.diff(timestamps)))
+    return 1.0 / interval if interval > 0 else default
+
+
+def _render_segment(h5_path, start, stop, out_path, fps, fourcc, chunk_size):
+    """
+    工作进程：渲染 [start, stop) 帧并编码为一个视频片段
+    画面按块读取后直接在读出的数组上绘制，不再逐帧复制
+    :return: 渲染的帧数
+    """
+    with Recording(h5_path, chunk_size=chunk_size) as rec:
+        h, w = rec.frame_shape[:2]
+        # 无法推算采集几何信息时按 1920x1080 全屏录制绘制
+        transform = rec.geometry['screen_to_frame'] if rec.geometry is not None else None
+        geometry = overlay_geometry(rec.read_states(slice(start, stop)), rec.frame_shape,
+                                    transform=transform)
+        writer = cv2.VideoWriter(out_path, cv2.VideoWriter_fourcc(*fourcc), fps, (w, h))
+        if not writer.isOpened():
+            raise RuntimeError(f"无法创建视频文件: {out_path}")
+        try:
+            i = 0
+            for frames, _ in rec.iter_chunks(start, stop):
+                for frame in frames:
+                    draw_overlay_at(frame, geometry, i)
+                    writer.write(frame)
+                    i += 1
+        finally:
+            writer.release()
+    return i
+
+
+def _concat_segments(segments, out_path, fps, fourcc):
+    """
+    按顺序拼接视频片段
+    有 ffmpeg 时直接复制码流；否则用 OpenCV 解码后重新编码
+    """
+    if len(segments) == 1:
+        shutil.move(segments[0], out_path)
+        return
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg:
+        list_path = out_path + '.segments.txt'
+        with open(list_path, 'w', encoding='utf-8') as f:
+            for seg in segments:
+                f.write(f"file '{os.path.abspath(seg)}'\n")
+        try:
+            subprocess.run([ffmpeg, '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+                            '-i', list_path, '-c', 'copy', out_path], check=True)
+        finally:
+            os.remove(list_path)
+        return
+    writer = None
+    try:
+        for seg in segments:
+            cap = cv2.VideoCapture(seg)
+            while True:
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                if writer is None:
+                    h, w = frame.shape[:2]
+                    writer = cv2.VideoWriter(out_path, cv2.VideoWriter_fourcc(*fourcc), fps, (w, h))
+                writer.write(frame)
+            cap.release()
+    finally:
+        if writer is not None:
+            writer.release()
+
+
+def export_video(h5_path, out_path, fps=None, workers=None, fourcc='mp4v', chunk_size=256,
+                 verbose=True):
+    """
+    把录制文件导出为带叠加层（按键、鼠标光标、速度向量）的视频
+    帧区间平均分给多个工作进程，各自读取、绘制并编码一个片段，最后按顺序拼接；
+    叠加层的坐标缩放和几何在每个片段内一次性向量化计算。
+    :param h5_path: 录制文件路径
+    :param out_path: 输出视频路径（.mp4）
+    :param fps: 输出帧率，None 时由采集时间戳估计
+    :param workers: 工作进程数，None 使用 CPU 核数
+    :param fourcc: 视频编码的 FourCC
+    :param chunk_size: 每次从文件读取的帧数
+    :param verbose: 是否打印结果
+    :return: 结果字典
+    """
+    with Recording(h5_path) as rec:
+        length = len(rec)
+        if fps is None:
+            fps = _estimate_fps(rec.timestamps)
+    workers = max(1, min(workers or os.cpu_count() or 1, length))
+    bounds = np.linspace(0, length, workers + 1).astype(int)
+
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(out_path))) as tmp:
+        segments = [os.path.join(tmp, f"part{k:03d}.mp4") for k in range(workers)]
+        if workers == 1:
+            frames = [_render_segment(h5_path, 0, length, segments[0], fps, fourcc, chunk_size)]
+        else:
+            ctx = mp.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+                futures = [
+                    pool.submit(_render_segment, h5_path, int(bounds[k]), int(bounds[k + 1]),
+                                segments[k], fps, fourcc, chunk_size)
+                    for k in range(workers)
+                ]
+                frames = [f.result() for f in futures]
+        render_time = time.perf_counter() - start
+        _concat_segments(segments, out_path, fps, fourcc)
+    elapsed = time.perf_counter() - start
+
+    total = sum(frames)
+    result = {
+        'frames': total,
+        'workers': workers,
+        'fps': total / elapsed if elapsed > 0 else 0.0,
+        'render_fps': total / render_time if render_time > 0 else 0.0,
+        'seconds': elapsed,
+    }
+    if verbose:
+        print(f"导出 {total} 帧 -> {out_path}: {result['fps']:.1f} 帧/秒 "
+              f"(渲染 {result['render_fps']:.1f} 帧/秒, {workers} 个进程, 共 {elapsed:.1f} 秒)")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="导出带叠加层的录制视频")
+    parser.add_argument('h5_path', help="录制文件路径")
+    parser.add_argument('out_path', help="输出视频路径")
+    parser.add_argument('--fps', type=float, default=None, help="输出帧率，默认由时间戳估计")
+    parser.add_argument('--workers', type=int, default=None, help="工作进程数，默认 CPU 核数")
+    parser.add_argument('--fourcc', default='mp4v')
+    parser.add_argument('--chunk-size', type=int, default=256)
+    args = parser.parse_args()
+    export_video(args.h5_path, args.out_path, args.fps, args.workers, args.fourcc, args.chunk_size)
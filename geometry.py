@@ -0,0 +1,101 @@
+import numpy as np
+
+# 状态向量中按键之后的维度：鼠标位置(2) + 鼠标速度(2) + 鼠标按键(3)
+MOUSE_DIM = 7
+
+# 没有几何信息的旧文件按全屏 1920x1080 录制处理（与旧版回放工具的假设一致）
+DEFAULT_SOURCE_SIZE = (1920, 1080)
+
+# 读取时鼠标位置的坐标系
+SCREEN = 'screen'          # 原始屏幕坐标（录制时的值）
+FRAME = 'frame'            # 画面像素坐标
+NORMALIZED = 'normalized'  # 相对采集区域的 [0, 1] 坐标
+POSITION_MODES = (SCREEN, FRAME, NORMALIZED)
+
+
+def screen_to_frame(capture_rect, frame_size):
+    """
+    屏幕坐标到画面坐标的变换 frame = (screen - offset) * scale
+    :param capture_rect: 采集区域 {'left', 'top', 'width', 'height'}
+    :param frame_size: 画面大小 (W, H)
+    :return: (scale_x, scale_y, offset_x, offset_y) float64 数组
+    """
+    return np.array([
+        frame_size[0] / capture_rect['width'],
+        frame_size[1] / capture_rect['height'],
+        capture_rect['left'],
+        capture_rect['top'],
+    ], dtype=np.float64)
+
+
+def write_geometry(attrs, capture_rect, target_size):
+    """
+    把采集几何信息写入 HDF5 属性
+    :param attrs: h5py 的 attrs 对象
+    :param capture_rect: 采集区域
+    :param target_size: 保存的画面大小 (W, H)
+    """
+    attrs['capture_rect'] = [capture_rect['left'], capture_rect['top'],
+                             capture_rect['width'], capture_rect['height']]
+    attrs['target_size'] = list(target_size)
+    attrs['screen_to_frame'] = screen_to_frame(capture_rect, target_size)
+
+
+def read_geometry(attrs, frame_shape=None):
+    """
+    读取采集几何信息，旧文件没有这些属性时按 DEFAULT_SOURCE_SIZE 全屏推算
+    :param attrs: h5py 的 attrs 对象
+    :param frame_shape: 画面形状 (H, W, 3)，用于旧文件的推算
+    :return: dict: capture_rect, target_size, screen_to_frame；无法推算时返回 None
+    """
+    if 'screen_to_frame' in attrs:
+        left, top, width, height = (int(v) for v in attrs['capture_rect'])
+        return {
+            'capture_rect': {'left': left, 'top': top, 'width': width, 'height': height},
+            'target_size': tuple(int(v) for v in attrs['target_size']),
+            'screen_to_frame': np.asarray(attrs['screen_to_frame'], dtype=np.float64),
+        }
+    if frame_shape is None:
+        return None
+    rect = {'left': 0, 'top': 0, 'width': DEFAULT_SOURCE_SIZE[0], 'height': DEFAULT_SOURCE_SIZE[1]}
+    target_size = (int(frame_shape[1]), int(frame_shape[0]))
+    return {
+        'capture_rect': rect,
+        'target_size': target_size,
+        'screen_to_frame': screen_to_frame(rect, target_size),
+    }
+
+
+def to_frame(positions, transform):
+    """
+    把屏幕坐标批量映射到画面坐标
+    :param positions: (..., 2) 屏幕坐标
+    :param transform: screen_to_frame 变换
+    :return: (..., 2) float64 画面坐标
+    """
+    return (np.asarray(positions, dtype=np.float64) - transform[2:]) * transform[:2]
+
+
+def transform_states(states, transform, target_size, mode=SCREEN):
+    """
+    按坐标系转换状态向量中的鼠标位置和速度，返回新数组
+    'frame' 时位置为画面像素坐标、速度为画面像素/秒；
+    'normalized' 时位置为相对采集区域的 [0, 1] 坐标、速度为每秒移动的区域比例
+    :param states: (N, D) 或 (D,) 状态数组
+    :param transform: screen_to_frame 变换
+    :param target_size: 画面大小 (W, H)
+    :param mode: 'screen' / 'frame' / 'normalized'
+    :return: 状态数组
+    """
+    if mode not in POSITION_MODES:
+        raise ValueError(f"未知的坐标系: {mode}")
+    if mode == SCREEN:
+        return states
+    states = np.array(states, dtype=np.float32)
+    k = states.shape[-1] - MOUSE_DIM
+    scale = transform[:2]
+    if mode == NORMALIZED:
+        scale = scale / np.asarray(target_size, dtype=np.float64)
+    states[..., k:k+2] = (states[..., k:k+2] - transform[2:]) * scale
+    states[..., k+2:k+4] *= scale
+    return states
@@ -0,0 +1,260 @@
+import itertools
+import math
+import time
+from threading import Lock
+
+import numpy as np
+
+from scheduler import now
+
+# 事件类型
+KEY_PRESS = 0
+KEY_RELEASE = 1
+MOUSE_MOVE = 2
+MOUSE_CLICK = 3   # code 为鼠标按键序号，value 为 1 按下 / 0 释放
+MOUSE_SCROLL = 4  # code 为水平滚动量，value 为垂直滚动量
+
+# 鼠标速度估计方式
+WINDOW = 'window'  # 两次采样之间的平均速度（位移 / 时间）
+EMA = 'ema'        # 按时间常数做指数平滑的瞬时速度
+VELOCITY_MODES = (WINDOW, EMA)
+
+# time: 事件时间（scheduler.now 时间轴）; code: 按键序号或按键类型; value: 附加数值;
+# x, y: 鼠标位置
+EVENT_DTYPE = np.dtype([
+    ('time', np.float64),
+    ('type', np.uint8),
+    ('code', np.int16),
+    ('value', np.float32),
+    ('x', np.float32),
+    ('y', np.float32),
+])
+
+
+class EventRing:
+    """
+    预分配的输入事件环形缓冲区
+    pynput 回调线程调用 append() 写入，写盘线程调用 drain() 批量取出。
+    写入端不加锁：槽位通过 itertools.count 领取（在 GIL 下是原子操作），
+    写完数据后再写入该槽位的序号作为提交标记，读取端只取已提交的连续区间。
+    读取端落后超过一整圈时，被覆盖的事件计入 overflow。
+    """
+
+    def __init__(self, capacity=65536):
+        """
+        :param capacity: 缓冲区容量（事件数）
+        """
+        self.capacity = capacity
+        self.buffer = np.zeros(capacity, dtype=EVENT_DTYPE)
+        self._committed = np.full(capacity, -1, dtype=np.int64)
+        self._ticket = itertools.count()
+        self._read = 0
+        self.overflow = 0
+
+    def append(self, etype, code=0, value=0.0, x=0.0, y=0.0):
+        """
+        记录一个事件，在输入回调线程中调用
+        :param etype: 事件类型
+        :param code: 按键序号等
+        :param value: 附加数值
+        :param x: 鼠标X坐标
+        :param y: 鼠标Y坐标
+        """
+        n = next(self._ticket)
+        i = n % self.capacity
+        self.buffer[i] = (now(), etype, code, value, x, y)
+        self._committed[i] = n
+
+    def drain(self):
+        """
+        取出所有已提交且尚未读取的事件
+        :return: EVENT_DTYPE 结构化数组（副本），按发生顺序排列
+        """
+        start = self._read
+        seqs = np.arange(start, start + self.capacity)
+        marks = self._committed[seqs % self.capacity]
+        if marks[0] > start:
+            # 写入端已经套圈，从仍然有效的最旧事件开始读
+            newest = int(self._committed.max())
+            oldest = newest - self.capacity + 1
+            self.overflow += oldest - start
+            start = oldest
+            seqs = np.arange(start, start + self.capacity)
+            marks = self._committed[seqs % self.capacity]
+        ready = marks == seqs
+        count = self.capacity if ready.all() else int(np.argmin(ready))
+        if count == 0:
+            return np.empty(0, dtype=EVENT_DTYPE)
+        events = self.buffer[seqs[:count] % self.capacity].copy()
+        self._read = start + count
+        return events
+
+    def clear(self):
+        """
+        丢弃所有未读取的事件
+        """
+        self.drain()
+
+
+class StateBlock:
+    """
+    预分配的 float32 状态向量，由输入监听线程原地更新，采集线程整体复制
+    写入端之间用一把锁互斥，读写之间用顺序锁（seqlock）：写入前后各把序号加 1，
+    读取端在序号为偶数且复制前后未变化时才算得到一致的快照，否则让出 CPU 重试。
+    采集线程不加锁，也不为每帧分配新数组。
+    """
+
+    def __init__(self, dim):
+        """
+        :param dim: 状态向量维度
+        """
+        self.values = np.zeros(dim, dtype=np.float32)
+        self._seq = 0
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self.values)
+
+    def set(self, index, *values):
+        """
+        从 index 开始原地写入一个或多个值，在输入回调线程中调用
+        :param index: 起始维度
+        :param values: 要写入的值
+        """
+        with self._lock:
+            self._seq += 1
+            self.values[index:index + len(values)] = values
+            self._seq += 1
+
+    def snapshot(self, out=None):
+        """
+        取得一致的状态快照
+        :param out: 预分配的输出数组 (dim,)，None 时新建
+        :return: out
+        """
+        if out is None:
+            out = np.empty_like(self.values)
+        while True:
+            seq = self._seq
+            if not seq & 1:
+                np.copyto(out, self.values)
+                if self._seq == seq:
+                    return out
+            time.sleep(0)
+
+
+class MouseVelocity:
+    """
+    鼠标速度估计器
+    update() 在 pynput 回调线程中调用，每个事件 O(1)；sample() 在采集线程中每帧调用一次。
+    'window' 模式下回调只记录位置，sample() 返回自上次采样以来的平均速度，
+    即"这一帧内的移动"，与事件的频率无关；
+    'ema' 模式下回调按事件间隔做指数平滑（时间常数 tau），
+    sample() 再按距最后一个事件的时长衰减，鼠标停下后速度会回落到 0。
+    位置和平滑结果都以单个元组整体替换，采样端不会读到一半更新的值。
+    """
+
+    def __init__(self, mode=WINDOW, tau=0.05):
+        """
+        :param mode: 估计方式 'window' / 'ema'
+        :param tau: 'ema' 模式的时间常数（秒）
+        """
+        if mode not in VELOCITY_MODES:
+            raise ValueError(f"未知的速度估计方式: {mode}")
+        self.mode = mode
+        self.tau = tau
+        self.reset()
+
+    def reset(self, x=0.0, y=0.0, t=None):
+        """
+        以给定位置和时刻重新开始估计
+        """
+        t = now() if t is None else t
+        self._pos = (x, y, t)
+        self._sample = (x, y, t)
+        self._ema = (0.0, 0.0, t)
+
+    def update(self, x, y, t=None):
+        """
+        记录一次鼠标移动，在输入回调线程中调用
+        :param x: 鼠标X坐标
+        :param y: 鼠标Y坐标
+        :param t: 事件时间，默认为当前时间
+        """
+        t = now() if t is None else t
+        if self.mode == EMA:
+            px, py, pt = self._pos
+            dt = t - pt
+            if dt > 0:
+                a = 1.0 - math.exp(-dt / self.tau)
+                vx, vy, _ = self._ema
+                self._ema = (vx + a * ((x - px) / dt - vx), vy + a * ((y - py) / dt - vy), t)
+        self._pos = (x, y, t)
+
+    def sample(self, t=None):
+        """
+        取得 t 时刻的速度估计，在采集线程中每帧调用一次
+        :param t: 采样时刻，默认为当前时间
+        :return: (vx, vy) 像素/秒
+        """
+        t = now() if t is None else t
+        if self.mode == EMA:
+            vx, vy, te = self._ema
+            if t > te:
+                decay = math.exp(-(t - te) / self.tau)
+                vx, vy = vx * decay, vy * decay
+            return vx, vy
+        x, y, _ = self._pos
+        sx, sy, st = self._sample
+        self._sample = (x, y, t)
+        dt = t - st
+        if dt <= 0:
+            return 0.0, 0.0
+        return (x - sx) / dt, (y - sy) / dt
+
+
+def states_at(events, times, num_keys, num_buttons=3):
+    """
+    由事件流重建任意时刻的状态向量，格式与录制时的 states 相同：
+    按键 + 鼠标位置(2) + 鼠标速度(2) + 鼠标按键(num_buttons)
+    速度为相邻采样时刻之间的平均速度（与 MouseVelocity 的 'window' 模式一致），第一个时刻为 0
+    :param events: EVENT_DTYPE 数组
+    :param times: 采样时刻 (N,)，需递增
+    :param num_keys: 按键数量
+    :param num_buttons: 鼠标按键数量
+    :return: (N, num_keys + 4 + num_buttons) float32 数组
+    """
+    times = np.asarray(times, dtype=np.float64)
+    events = np.sort(events, order='time', kind='stable')
+    out = np.zeros((len(times), num_keys + 4 + num_buttons), dtype=np.float32)
+
+    def last_value(mask, values, column):
+        t = events['time'][mask]
+        if len(t) == 0:
+            return
+        idx = np.searchsorted(t, times, side='right') - 1
+        valid = idx >= 0
+        out[valid, column] = values[idx[valid]]
+
+    etype = events['type']
+    code = events['code']
+    for k in range(num_keys):
+        mask = ((etype == KEY_PRESS) | (etype == KEY_RELEASE)) & (code == k)
+        last_value(mask, (etype[mask] == KEY_PRESS).astype(np.float32), k)
+
+    # 鼠标位置：移动、点击和滚动事件都带有位置
+    moved = (etype == MOUSE_MOVE) | (etype == MOUSE_CLICK) | (etype == MOUSE_SCROLL)
+    last_value(moved, events['x'][moved], num_keys)
+    last_value(moved, events['y'][moved], num_keys + 1)
+
+    dt = np.diff(times)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for axis in range(2):
+            pos = out[:, num_keys + axis]
+            vel = np.where(dt > 0, np.diff(pos) / dt, 0)
+            out[1:, num_keys + 2 + axis] = vel
+
+    for b in range(num_buttons):
+        mask = (etype == MOUSE_CLICK) & (code == b)
+        last_value(mask, events['value'][mask], num_keys + 4 + b)
+    return out
@@ -0,0 +1,92 @@
+import json
+import os
+
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 1
+
+
+class SessionManifest:
+    """
+    录制会话清单，与分片文件一起保存在会话目录下的 manifest.json 中
+    记录每个分片的路径、帧数、首末时间戳，以及状态向量结构和采集设置，
+    读取端据此直接定位分片，无需打开 HDF5 文件扫描键名。
+    """
+
+    def __init__(self, session_dir, state_schema=None, settings=None):
+        """
+        :param session_dir: 会话目录
+        :param state_schema: 状态向量各维度的名称列表
+        :param settings: 采集设置字典
+        """
+        self.session_dir = session_dir
+        self.state_schema = list(state_schema or [])
+        self.settings = dict(settings or {})
+        self.shards = []
+
+    @property
+    def path(self):
+        return os.path.join(self.session_dir, MANIFEST_NAME)
+
+    @property
+    def num_frames(self):
+        return sum(s['frames'] for s in self.shards)
+
+    def add_shard(self, path, frames, first_timestamp=None, last_timestamp=None, **extra):
+        """
+        登记一个已写完的分片
+        :param path: 分片路径，保存为相对会话目录的路径
+        :param frames: 帧数
+        :param first_timestamp: 第一帧采集时间
+        :param last_timestamp: 最后一帧采集时间
+        :param extra: 其他信息（如布局、压缩方式）
+        """
+        entry = {
+            'path': os.path.relpath(path, self.session_dir),
+            'frames': int(frames),
+            'first_timestamp': first_timestamp,
+            'last_timestamp': last_timestamp,
+        }
+        entry.update(extra)
+        self.shards.append(entry)
+        return entry
+
+    def shard_paths(self):
+        """
+        :return: 所有分片的完整路径
+        """
+        return [os.path.join(self.session_dir, s['path']) for s in self.shards]
+
+    def to_dict(self):
+        return {
+            'version': MANIFEST_VERSION,
+            'state_schema': self.state_schema,
+            'settings': self.settings,
+            'num_frames': self.num_frames,
+            'shards': self.shards,
+        }
+
+    def save(self):
+        """
+        写入清单，先写临时文件再替换，避免中途退出留下残缺文件
+        """
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp, self.path)
+
+    @classmethod
+    def load(cls, session_dir):
+        """
+        读取会话清单
+        :param session_dir: 会话目录
+        :return: SessionManifest
+        """
+        with open(os.path.join(session_dir, MANIFEST_NAME), encoding='utf-8') as f:
+            data = json.load(f)
+        manifest = cls(session_dir, data.get('state_schema'), data.get('settings'))
+        manifest.shards = data.get('shards', [])
+        return manifest
+
+    @staticmethod
+    def exists(session_dir):
+        return os.path.isfile(os.path.join(session_dir, MANIFEST_NAME))
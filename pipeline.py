@@ -0,0 +1,210 @@
+from collections import deque
+from threading import Thread, Lock, Condition
+
+# 队列满时的背压策略
+BLOCK = 'block'              # 阻塞采集线程直到有空位
+DROP_OLDEST = 'drop_oldest'  # 丢弃队列中最旧的一项
+DROP_NEWEST = 'drop_newest'  # 丢弃新到达的一项
+POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST)
+
+# 录制器连续写入失败这么多批后停止录制
+MAX_WRITE_ERRORS = 3
+
+
+class WriterPipeline:
+    """
+    采集与写盘解耦的生产者/消费者管线
+    采集线程通过 put() 把 (frame, state, timestamp, scheduled) 放入有界环形队列，
+    写入线程按批取出并交给 sink 写入文件。
+    多个写入线程时，prepare 阶段并行执行，sink 仍按入队顺序串行调用。
+    """
+
+    def __init__(self, sink, capacity=128, batch_size=32, num_writers=1,
+                 policy=BLOCK, prepare=None, on_drop=None, max_errors=None, on_fail=None):
+        """
+        :param sink: 写入函数，参数为一批数据项的列表
+        :param capacity: 队列容量
+        :param batch_size: 每批最多取出的数据项数
+        :param num_writers: 写入线程数
+        :param policy: 队列满时的背压策略 'block' / 'drop_oldest' / 'drop_newest'
+        :param prepare: 可选的批预处理函数（如编码），在写入线程中并行执行
+        :param on_drop: 可选回调，未入队、被挤出队列或预处理失败的数据项会传给它（如归还缓冲区）
+        :param max_errors: 连续出错达到该批数时调用 on_fail，None 表示只计数
+        :param on_fail: 可选回调 on_fail(exception)，连续出错达到 max_errors 时调用一次
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"未知的背压策略: {policy}")
+        self.sink = sink
+        self.prepare = prepare
+        self.on_drop = on_drop
+        self.max_errors = max_errors
+        self.on_fail = on_fail
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.num_writers = num_writers
+        self.policy = policy
+
+        self._queue = deque()
+        self._lock = Lock()
+        self._not_empty = Condition(self._lock)
+        self._not_full = Condition(self._lock)
+        self._closed = False
+        self._threads = []
+
+        # 保证多写入线程时按顺序写盘
+        self._order = Condition()
+        self._next_take = 0
+        self._next_write = 0
+
+        # 统计计数
+        self.max_depth = 0
+        self.dropped = 0
+        self.written = 0
+        self.errors = 0
+        self._consecutive_errors = 0
+
+    @property
+    def depth(self):
+        """
+        当前队列深度
+        """
+        return len(self._queue)
+
+    def stats(self):
+        """
+        获取管线统计信息
+        :return: 包含队列深度、最大深度、丢帧数、已写入数的字典
+        """
+        return {
+            'depth': self.depth,
+            'max_depth': self.max_depth,
+            'dropped': self.dropped,
+            'written': self.written,
+            'errors': self.errors,
+        }
+
+    def start(self):
+        """
+        启动写入线程
+        """
+        self._closed = False
+        for i in range(self.num_writers):
+            t = Thread(target=self._writer_loop, name=f"writer-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def put(self, item, timeout=None):
+        """
+        把一项数据放入队列
+        :param item: (frame, state, timestamp, scheduled) 元组
+        :param timeout: 阻塞策略下的最长等待时间，None 表示一直等待
+        :return: 是否成功入队
+        """
+        dropped = None
+        with self._lock:
+            if self._closed:
+                dropped = item
+            elif len(self._queue) >= self.capacity:
+                if self.policy == DROP_NEWEST:
+                    dropped = item
+                    self.dropped += 1
+                elif self.policy == DROP_OLDEST:
+                    dropped = self._queue.popleft()
+                    self.dropped += 1
+                elif not self._not_full.wait_for(
+                        lambda: len(self._queue) < self.capacity or self._closed,
+                        timeout):
+                    dropped = item
+                    self.dropped += 1
+                elif self._closed:
+                    dropped = item
+            if dropped is not item:
+                self._queue.append(item)
+                depth = len(self._queue)
+                if depth > self.max_depth:
+                    self.max_depth = depth
+                self._not_empty.notify()
+        if dropped is not None and self.on_drop is not None:
+            self.on_drop(dropped)
+        return dropped is not item
+
+    def stop(self):
+        """
+        停止接收新数据，等待队列中剩余数据全部写完
+        """
+        with self._lock:
+            self._closed = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+        for t in self._threads:
+            t.join()
+        self._threads = []
+
+    def _take_batch(self):
+        """
+        从队列取出一批数据
+        :return: (序号, 数据列表)，队列已关闭且为空时返回 (None, None)
+        """
+        with self._lock:
+            while not self._queue and not self._closed:
+                self._not_empty.wait()
+            if not self._queue:
+                return None, None
+            n = min(len(self._queue), self.batch_size)
+            batch = [self._queue.popleft() for _ in range(n)]
+            seq = self._next_take
+            self._next_take += 1
+            self._not_full.notify_all()
+        return seq, batch
+
+    def _writer_loop(self):
+        """
+        写入线程主循环
+        """
+        while True:
+            seq, batch = self._take_batch()
+            if batch is None:
+                break
+            count = len(batch)
+            error = None
+            if self.prepare is not None:
+                items = batch
+                try:
+                    batch = self.prepare(batch)
+                except Exception as e:
+                    print(f"预处理出错: {e}")
+                    error = e
+                    batch = None
+                    if self.on_drop is not None:
+                        for item in items:
+                            self.on_drop(item)
+
+            with self._order:
+                while self._next_write != seq:
+                    self._order.wait()
+                try:
+                    if batch is not None:
+                        self.sink(batch)
+                        self.written += count
+                except Exception as e:
+                    print(f"写入出错: {e}")
+                    error = e
+                finally:
+                    self._next_write += 1
+                    self._order.notify_all()
+                if error is None:
+                    self._consecutive_errors = 0
+                else:
+                    self._record_error(error)
+
+    def _record_error(self, error):
+        """
+        记录一次出错的批次，连续出错达到 max_errors 时通知 on_fail
+        在 _order 锁内调用
+        """
+        self.errors += 1
+        self._consecutive_errors += 1
+        if (self.max_errors is not None and self.on_fail is not None
+                and self._consecutive_errors == self.max_errors):
+            self.on_fail(error)
@@ -0,0 +1,234 @@
+import time
+from queue import Queue, Empty, Full
+from threading import Thread, Condition, Event
+
+import cv2
+import numpy as np
+
+# 播放控制按键
+KEY_QUIT = (27, ord('q'))         # ESC / q 退出
+KEY_PAUSE = (ord(' '), ord('k'))  # 空格 / k 暂停、继续
+KEY_BACK = ord('j')               # 后退 SEEK_SECONDS 秒
+KEY_FORWARD = ord('l')            # 前进 SEEK_SECONDS 秒
+KEY_STEP_BACK = ord(',')          # 暂停并后退一帧
+KEY_STEP_FORWARD = ord('.')       # 暂停并前进一帧
+KEY_SLOWER = ord('-')             # 速度减半
+KEY_FASTER = ord('=')             # 速度加倍
+
+SEEK_SECONDS = 10.0
+MIN_SPEED = 1 / 16
+MAX_SPEED = 16.0
+
+
+class FramePrefetcher:
+    """
+    后台线程按块顺序读取画面，播放线程只从内存中取帧
+    frames 可以是 numpy 数组或 Recording.frames 这类支持切片读取的序列；
+    最多预读 depth 个块，seek() 之后丢弃旧位置的预读结果。
+    """
+
+    def __init__(self, frames, chunk_size=64, depth=4):
+        """
+        :param frames: 支持 len() 和切片读取的画面序列
+        :param chunk_size: 每块帧数
+        :param depth: 最多预读的块数
+        """
+        self.frames = frames
+        self.length = len(frames)
+        self.chunk_size = chunk_size
+        self.depth = depth
+        self._queue = Queue(maxsize=depth)
+        self._cond = Condition()
+        self._stop = Event()
+        self._gen = 0
+        self._pos = 0
+        self._chunk = None
+        self._next = 0
+        self._thread = Thread(target=self._read_loop, name="playback-prefetch", daemon=True)
+        self._thread.start()
+
+    def _read_loop(self):
+        """
+        预读线程：从当前位置开始依次读取块放入队列
+        """
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._stop.is_set() or self._pos < self.length)
+                if self._stop.is_set():
+                    return
+                gen, start = self._gen, self._pos
+                stop = min(start + self.chunk_size, self.length)
+                self._pos = stop
+            try:
+                item = (gen, start, self.frames[start:stop])
+            except Exception as e:
+                item = (gen, start, e)
+            while not self._stop.is_set():
+                try:
+                    self._queue.put(item, timeout=0.1)
+                    break
+                except Full:
+                    if gen != self._gen:
+                        break
+
+    def seek(self, index):
+        """
+        从 index 开始重新预读
+        """
+        with self._cond:
+            self._gen += 1
+            self._pos = index
+            self._cond.notify()
+        self._chunk = None
+        self._next = index
+        while True:
+            try:
+                self._queue.get_nowait()
+            except Empty:
+                break
+
+    def get(self, index):
+        """
+        取得第 index 帧，向前跳过少量帧时沿用预读结果，否则重新定位
+        :return: (H, W, 3) 画面
+        """
+        while True:
+            if self._chunk is not None:
+                start, frames = self._chunk
+                if start <= index < start + len(frames):
+                    return frames[index - start]
+            if not self._next <= index < self._next + self.chunk_size * self.depth:
+                self.seek(index)
+            gen, start, frames = self._queue.get()
+            if gen != self._gen:
+                continue
+            if isinstance(frames, Exception):
+                raise frames
+            self._chunk = (start, frames)
+            self._next = start + len(frames)
+
+    def close(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify()
+        self._thread.join()
+
+
+class Player:
+    """
+    录制回放引擎
+    画面由 FramePrefetcher 在后台线程中读取，不需要把整个录制文件载入内存；
+    播放进度跟随挂钟时间：落后时直接跳到当前应显示的帧（丢帧），
+    超前时等待到下一帧的显示时刻，绘制耗时不会拖慢回放。
+    有采集时间戳时按时间戳回放，否则按 fps 回放。
+    叠加层绘制在复用的画布上，不修改读取到的画面。
+    """
+
+    def __init__(self, frames, states, timestamps=None, render=None, fps=30, speed=1.0,
+                 window='Recording Playback', chunk_size=64, prefetch=4):
+        """
+        :param frames: 画面数组或 Recording.frames 惰性序列
+        :param states: 状态数组 (N, D)
+        :param timestamps: 采集时间戳 (N,)，None 时按 fps 计算
+        :param render: 叠加层绘制函数 render(canvas, index, state)，原地绘制
+        :param fps: 没有时间戳时的播放帧率
+        :param speed: 初始播放倍速
+        :param window: 窗口名称
+        :param chunk_size: 预读块大小
+        :param prefetch: 预读块数
+        """
+        self.frames = frames
+        self.states = states
+        self.length = len(frames)
+        self.render = render
+        self.speed = speed
+        self.window = window
+        self.chunk_size = chunk_size
+        self.prefetch = prefetch
+        if timestamps is not None and len(timestamps) == self.length and np.all(np.diff(timestamps) >= 0):
+            self.times = np.asarray(timestamps, dtype=np.float64) - timestamps[0]
+        else:
+            self.times = np.arange(self.length, dtype=np.float64) / fps
+        # 最后一帧显示一个帧间隔后结束
+        self.duration = (self.times[-1] if self.length else 0.0) + 1.0 / fps
+        self.shown = 0
+        self.dropped = 0
+        self._canvas = None
+
+    def _frame_at(self, media_time):
+        """
+        media_time 时刻应显示的帧
+        """
+        index = int(np.searchsorted(self.times, media_time, side='right')) - 1
+        return min(max(index, 0), self.length - 1)
+
+    def _draw(self, prefetcher, index):
+        frame = prefetcher.get(index)
+        if self._canvas is None or self._canvas.shape != frame.shape:
+            self._canvas = np.empty_like(frame)
+        np.copyto(self._canvas, frame)
+        if self.render is not None:
+            self.render(self._canvas, index, self.states[index])
+        cv2.imshow(self.window, self._canvas)
+
+    def run(self, start_frame=0):
+        """
+        开始播放，直到播放结束或按下退出键
+        :param start_frame: 开始播放的帧索引
+        """
+        if self.length == 0:
+            return
+        prefetcher = FramePrefetcher(self.frames, self.chunk_size, self.prefetch)
+        index = min(max(start_frame, 0), self.length - 1)
+        prefetcher.seek(index)
+        paused = False
+        shown = None
+        anchor_wall = time.perf_counter()
+        anchor_media = self.times[index]
+        try:
+            while True:
+                if not paused:
+                    media = anchor_media + (time.perf_counter() - anchor_wall) * self.speed
+                    if media >= self.duration and shown == self.length - 1:
+                        break
+                    index = self._frame_at(media)
+                if index != shown:
+                    if shown is not None and not paused and index > shown + 1:
+                        self.dropped += index - shown - 1
+                    self._draw(prefetcher, index)
+                    self.shown += 1
+                    shown = index
+
+                # 等到下一帧的显示时刻，期间响应按键
+                if paused or index + 1 >= self.length:
+                    delay = 30
+                else:
+                    due = anchor_wall + (self.times[index + 1] - anchor_media) / self.speed
+                    delay = max(1, int((due - time.perf_counter()) * 1000))
+                key = cv2.waitKey(delay)
+                if key < 0:
+                    continue
+                key &= 0xFF
+                if key in KEY_QUIT:
+                    break
+                if key in KEY_PAUSE:
+                    paused = not paused
+                elif key in (KEY_STEP_BACK, KEY_STEP_FORWARD):
+                    paused = True
+                    index += 1 if key == KEY_STEP_FORWARD else -1
+                    index = min(max(index, 0), self.length - 1)
+                elif key in (KEY_BACK, KEY_FORWARD):
+                    offset = SEEK_SECONDS if key == KEY_FORWARD else -SEEK_SECONDS
+                    index = self._frame_at(self.times[index] + offset)
+                    shown = None  # 定位跳过的帧不计入丢帧
+                elif key in (KEY_SLOWER, KEY_FASTER):
+                    factor = 2.0 if key == KEY_FASTER else 0.5
+                    self.speed = min(max(self.speed * factor, MIN_SPEED), MAX_SPEED)
+                    print(f"播放速度: {self.speed:g}x")
+                # 暂停、定位、变速后以当前帧重新对齐时钟
+                anchor_wall = time.perf_counter()
+                anchor_media = self.times[index]
+        finally:
+            prefetcher.close()
+            cv2.destroyWindow(self.window)
+        return self
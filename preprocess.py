@@ -0,0 +1,152 @@
+from threading import Lock, Condition
+
+import cv2
+import numpy as np
+
+
+class FramePool:
+    """
+    预分配、可复用的帧缓冲池
+    采集线程 acquire() 取得一个槽位，把预处理结果直接写入该槽位，
+    写盘线程写完后 release() 归还，整个过程不再为画面分配新内存。
+    给定 state_dim 时每个槽位还带一行状态向量 states[slot]，与画面一起归还。
+    """
+
+    def __init__(self, frame_shape, size, state_dim=None):
+        """
+        :param frame_shape: 单帧形状 (H, W, 3)
+        :param size: 槽位数量，应不小于队列容量 + 写盘线程在途帧数 + 1
+        :param state_dim: 状态向量维度，None 表示不分配状态缓冲区
+        """
+        self.frame_shape = tuple(frame_shape)
+        self.size = size
+        self.buffers = np.empty((size,) + self.frame_shape, dtype=np.uint8)
+        self.states = np.zeros((size, state_dim), dtype=np.float32) if state_dim else None
+        self._free = list(range(size - 1, -1, -1))
+        self._lock = Lock()
+        self._available = Condition(self._lock)
+
+    def __getitem__(self, slot):
+        return self.buffers[slot]
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def free(self):
+        """
+        空闲槽位数
+        """
+        return len(self._free)
+
+    def acquire(self, timeout=None):
+        """
+        获取一个空闲槽位
+        :param timeout: 最长等待时间，None 表示一直等待
+        :return: 槽位编号，超时返回 None
+        """
+        with self._lock:
+            if not self._available.wait_for(lambda: self._free, timeout):
+                return None
+            return self._free.pop()
+
+    def release(self, slot):
+        """
+        归还槽位
+        :param slot: 槽位编号
+        """
+        with self._lock:
+            self._free.append(slot)
+            self._available.notify()
+
+
+def screenshot_view(shot):
+    """
+    把 mss 截图包装为 (H, W, 4) 的 BGRA 视图，不复制像素
+    :param shot: mss.ScreenShot
+    :return: 与截图共享内存的 uint8 数组
+    """
+    return np.frombuffer(shot.raw, dtype=np.uint8).reshape(shot.height, shot.width, 4)
+
+
+class FramePreprocessor:
+    """
+    把采集到的 BGR/BGRA 画面缩放并去掉 alpha 通道，直接写入预分配的输出缓冲区
+    缩小时先在 4 通道上缩放再转色，转色只处理缩小后的像素；
+    中间结果使用复用的临时缓冲区。
+    """
+
+    def __init__(self, target_size, interpolation=cv2.INTER_LINEAR):
+        """
+        :param target_size: 输出图像大小 (W, H)
+        :param interpolation: 缩放插值方式
+        """
+        self.target_size = tuple(target_size)
+        self.interpolation = interpolation
+        self._scratch = np.empty((target_size[1], target_size[0], 4), dtype=np.uint8)
+
+    def __call__(self, src, out):
+        """
+        :param src: (H, W, 3) 或 (H, W, 4) 的原始画面
+        :param out: (h, w, 3) 的输出缓冲区
+        :return: out
+        """
+        same_size = src.shape[0] == out.shape[0] and src.shape[1] == out.shape[1]
+        if src.shape[2] == 4:
+            if same_size:
+                cv2.cvtColor(src, cv2.COLOR_BGRA2BGR, dst=out)
+            else:
+                cv2.resize(src, self.target_size, dst=self._scratch,
+                           interpolation=self.interpolation)
+                cv2.cvtColor(self._scratch, cv2.COLOR_BGRA2BGR, dst=out)
+        elif same_size:
+            np.copyto(out, src)
+        else:
+            cv2.resize(src, self.target_size, dst=out, interpolation=self.interpolation)
+        return out
+
+
+class ChangeDetector:
+    """
+    低成本的画面变化检测
+    把画面缩小为缩略图（INTER_AREA 取块平均），与上一张判定为变化的画面的缩略图
+    比较平均绝对差，超过阈值才算变化。与最近保存的画面比较而不是与上一帧比较，
+    缓慢的渐变累积到阈值后同样会被保存。缩略图和差值使用复用的缓冲区。
+    """
+
+    def __init__(self, threshold=1.0, thumb_size=(32, 24)):
+        """
+        :param threshold: 平均绝对差阈值（0-255 灰度级），不超过该值视为未变化
+        :param thumb_size: 缩略图大小 (W, H)
+        """
+        self.threshold = threshold
+        self.thumb_size = tuple(thumb_size)
+        self._thumb = None
+        self._ref = None
+        self._diff = None
+
+    def reset(self):
+        """
+        清除参考画面，下一帧总是判定为变化
+        """
+        self._ref = None
+
+    def __call__(self, frame):
+        """
+        :param frame: (H, W, C) 画面
+        :return: 与参考画面相比是否发生变化
+        """
+        if self._thumb is None or self._thumb.shape[2:] != frame.shape[2:]:
+            shape = (self.thumb_size[1], self.thumb_size[0]) + frame.shape[2:]
+            self._thumb = np.empty(shape, dtype=np.uint8)
+            self._diff = np.empty(shape, dtype=np.uint8)
+            self._ref = None
+        cv2.resize(frame, self.thumb_size, dst=self._thumb, interpolation=cv2.INTER_AREA)
+        if self._ref is None:
+            self._ref = self._thumb.copy()
+            return True
+        cv2.absdiff(self._thumb, self._ref, dst=self._diff)
+        if self._diff.mean() <= self.threshold:
+            return False
+        np.copyto(self._ref, self._thumb)
+        return True
@@ -0,0 +1,214 @@
+import heapq
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from threading import Thread, Lock, Condition
+
+import numpy as np
+
+from codec import encode_frame
+from preprocess import FramePreprocessor
+
+
+def _worker_main(in_name, in_shape, out_name, out_shape, target_size, codec, quality,
+                 tasks, results):
+    """
+    工作进程：从共享内存输入槽位读取原始画面，缩放、去 alpha、编码后
+    写入共享内存输出槽位，编码结果通过队列返回
+    """
+    in_shm = shared_memory.SharedMemory(name=in_name)
+    out_shm = shared_memory.SharedMemory(name=out_name)
+    inputs = np.ndarray(in_shape, dtype=np.uint8, buffer=in_shm.buf)
+    outputs = np.ndarray(out_shape, dtype=np.uint8, buffer=out_shm.buf)
+    preprocess = FramePreprocessor(target_size)
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            seq, slot = task
+            try:
+                preprocess(inputs[slot], outputs[slot])
+                encoded = encode_frame(outputs[slot], codec, quality).tobytes() if codec else None
+                results.put((seq, slot, encoded, None))
+            except Exception as e:
+                results.put((seq, slot, None, str(e)))
+    finally:
+        del inputs, outputs
+        in_shm.close()
+        out_shm.close()
+
+
+class ProcessFramePool:
+    """
+    多进程画面预处理/编码池
+    采集线程把原始画面复制进共享内存输入槽位（一次 memcpy）后立即返回，
+    工作进程在各自的解释器中完成缩放、去 alpha 和逐帧编码，不占用主进程的 GIL。
+    结果按提交顺序交给 on_result 回调（通常是 WriterPipeline.put），
+    回调项为 (slot, state, timestamp, scheduled, encoded)，画面在 pool[slot] 中，
+    写盘后需调用 release(slot) 归还槽位。
+    HDF5 文件不能被多个进程同时写入，写盘仍由主进程的写盘线程完成，
+    此时写盘线程只需复制已处理好的数据。
+    """
+
+    def __init__(self, target_size, num_slots, num_workers=2, codec=None, quality=90,
+                 on_result=None, state_dim=None):
+        """
+        :param target_size: 输出图像大小 (W, H)
+        :param num_slots: 共享内存槽位数
+        :param num_workers: 工作进程数
+        :param codec: 逐帧编码方式 'jpeg' / 'webp' / 'png'，None 表示只做缩放
+        :param quality: 编码质量
+        :param on_result: 按顺序接收处理结果的回调
+        :param state_dim: 状态向量维度，给定时提交的状态复制到槽位对应的行，
+            调用方可以复用同一个数组提交
+        """
+        self.target_size = tuple(target_size)
+        self.frame_shape = (target_size[1], target_size[0], 3)
+        self.size = num_slots
+        self.num_workers = num_workers
+        self.codec = codec
+        self.quality = quality
+        self.on_result = on_result
+        self.errors = 0
+        self.states = np.zeros((num_slots, state_dim), dtype=np.float32) if state_dim else None
+
+        self._inputs = None
+        self._outputs = None
+        self._in_shm = None
+        self._out_shm = None
+        self._workers = []
+        self._collector = None
+        self._free = list(range(num_slots - 1, -1, -1))
+        self._lock = Lock()
+        self._available = Condition(self._lock)
+        self._meta = {}
+        self._next_seq = 0
+
+    def __getitem__(self, slot):
+        return self._outputs[slot]
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def started(self):
+        return self._in_shm is not None
+
+    def start(self, src_shape):
+        """
+        按原始画面形状分配共享内存并启动工作进程
+        :param src_shape: 原始画面形状 (H, W, C)
+        """
+        ctx = mp.get_context('spawn')
+        in_shape = (self.size,) + tuple(src_shape)
+        out_shape = (self.size,) + self.frame_shape
+        self._in_shm = shared_memory.SharedMemory(create=True, size=int(np.prod(in_shape)))
+        self._out_shm = shared_memory.SharedMemory(create=True, size=int(np.prod(out_shape)))
+        self._inputs = np.ndarray(in_shape, dtype=np.uint8, buffer=self._in_shm.buf)
+        self._outputs = np.ndarray(out_shape, dtype=np.uint8, buffer=self._out_shm.buf)
+
+        self._tasks = ctx.Queue()
+        self._results = ctx.Queue()
+        for i in range(self.num_workers):
+            p = ctx.Process(
+                target=_worker_main,
+                args=(self._in_shm.name, in_shape, self._out_shm.name, out_shape,
+                      self.target_size, self.codec, self.quality, self._tasks, self._results),
+                name=f"frame-worker-{i}",
+                daemon=True
+            )
+            p.start()
+            self._workers.append(p)
+        self._collector = Thread(target=self._collect_loop, name="frame-collector", daemon=True)
+        self._collector.start()
+        return self
+
+    def submit(self, src, state, timestamp, scheduled=None, timeout=None):
+        """
+        提交一帧原始画面
+        :param src: (H, W, C) 原始画面
+        :param state: 状态向量
+        :param timestamp: 实际采集时间
+        :param scheduled: 计划采集时间
+        :param timeout: 等待空闲槽位的最长时间，None 表示一直等待
+        :return: 是否提交成功
+        """
+        if not self.started:
+            self.start(src.shape)
+        with self._lock:
+            if not self._available.wait_for(lambda: self._free, timeout):
+                return False
+            slot = self._free.pop()
+            seq = self._next_seq
+            self._next_seq += 1
+        if self.states is not None:
+            np.copyto(self.states[slot], state)
+            state = self.states[slot]
+        with self._lock:
+            self._meta[seq] = (state, timestamp, scheduled)
+        np.copyto(self._inputs[slot], src)
+        self._tasks.put((seq, slot))
+        return True
+
+    def release(self, slot):
+        """
+        归还槽位
+        """
+        with self._lock:
+            self._free.append(slot)
+            self._available.notify()
+
+    def _collect_loop(self):
+        """
+        收集工作进程的结果，按提交顺序交给 on_result
+        """
+        pending = []
+        expected = 0
+        while True:
+            result = self._results.get()
+            if result is None:
+                break
+            heapq.heappush(pending, result)
+            while pending and pending[0][0] == expected:
+                seq, slot, encoded, error = heapq.heappop(pending)
+                with self._lock:
+                    state, timestamp, scheduled = self._meta.pop(seq)
+                expected += 1
+                if error is not None:
+                    print(f"画面处理出错: {error}")
+                    self.errors += 1
+                    self.release(slot)
+                    continue
+                if encoded is not None:
+                    encoded = np.frombuffer(encoded, dtype=np.uint8)
+                self.on_result((slot, state, timestamp, scheduled, encoded))
+
+    def stop(self):
+        """
+        等待已提交的画面全部处理完毕并交给 on_result，然后关闭工作进程
+        输出槽位仍可访问，写盘完成后再调用 close()
+        """
+        if not self._workers:
+            return
+        for _ in self._workers:
+            self._tasks.put(None)
+        for p in self._workers:
+            p.join()
+        self._results.put(None)
+        self._collector.join()
+        self._workers = []
+
+    def close(self):
+        """
+        释放共享内存
+        """
+        self.stop()
+        if not self.started:
+            return
+        self._inputs = None
+        self._outputs = None
+        for shm in (self._in_shm, self._out_shm):
+            shm.close()
+            shm.unlink()
+        self._in_shm = None
+        self._out_shm = None
@@ -1,23 +1,63 @@
-import mss
-import cv2
 import numpy as np
-import h5py
 from pynput import keyboard, mouse
-import time
 from datetime import datetime
-import win32gui
 import os
+import sys
 from threading import Thread, Event
+from storage import open_store
+from pipeline import WriterPipeline, MAX_WRITE_ERRORS
+from scheduler import FrameScheduler
+from capture import MssCapture
+from preprocess import FramePool, FramePreprocessor
+from process_pool import ProcessFramePool
+from codec import IMAGE_CODECS
+from manifest import SessionManifest
+from input_log import EventRing, MouseVelocity, StateBlock, KEY_PRESS, KEY_RELEASE, MOUSE_MOVE, MOUSE_CLICK, MOUSE_SCROLL
 
 class GameRecorder:
-    def __init__(self, game_window_title=None, target_size=(320, 240)):
+    def __init__(self, game_window_title=None, target_size=(320, 240), layout='contiguous',
+                 queue_size=128, num_writers=1, backpressure='block',
+                 interval=0.03, schedule_policy='skip', capture=None, compression='none',
+                 process_workers=0, velocity_mode='window',
+                 dedup_threshold=None, sync_interval=None, shutdown_timeout=30.0):
         """
         初始化游戏录制器
         :param game_window_title: 游戏窗口标题，如果为None则录制全屏
         :param target_size: 保存的图像大小
+        :param layout: 存储布局，'contiguous' 为连续分块数组，'legacy' 为逐帧数据集，
+                       'memmap' 为可直接内存映射读取的原始数组（不压缩）
+        :param queue_size: 写盘队列容量（帧数）
+        :param num_writers: 写盘线程数
+        :param backpressure: 队列满时的策略 'block' / 'drop_oldest' / 'drop_newest'
+        :param interval: 采集间隔（秒），默认约30 FPS
+        :param schedule_policy: 错过采集时间时的策略 'skip' / 'catch_up'
+        :param capture: 画面采集后端，None 时使用 mss 录制窗口或全屏
+        :param compression: 画面压缩 'none' / 'gzip' / 'lzf' / 'jpeg' / 'webp' / 'png' / 'delta'
+        :param process_workers: 缩放/编码工作进程数，0 表示在采集线程中缩放
+        :param velocity_mode: 鼠标速度估计方式，'window' 为每帧内的平均速度，'ema' 为指数平滑
+        :param dedup_threshold: 画面去重阈值（缩略图平均绝对差），None 表示每帧都保存画面
+        :param sync_interval: 把缓存写入文件的间隔（秒），异常退出时最多丢失这段时间的数据；
+                              None 表示只在关闭时写入（吞吐最高），0 表示每批写入
+        :param shutdown_timeout: 退出时等待剩余数据写盘的最长时间（秒）
         """
         self.window_title = game_window_title
         self.target_size = target_size
+        self.layout = layout
+        self.compression = compression
+        self.process_workers = process_workers
+        self.dedup_threshold = dedup_threshold
+        self.sync_interval = sync_interval
+        self.shutdown_timeout = shutdown_timeout
+        self.queue_size = queue_size
+        self.num_writers = num_writers
+        self.backpressure = backpressure
+        self.interval = interval
+        self.schedule_policy = schedule_policy
+        self.capture = capture or MssCapture(game_window_title, window_size=(1920, 1080))
+        self.store = None
+        self.manifest = None
+        self.pipeline = None
+        self.frame_pool = None
         self.is_recording = False
         self.stop_flag = Event()
         
@@ -31,21 +71,31 @@ class GameRecorder:
             'j': 8, 'k': 9, 'l': 10          # 动作键
         }
         
-        # 初始化键盘状态
-        self.key_states = [0] * len(self.key_map)
+        # 状态向量各维度的名称：按键 + 鼠标位置(2) + 鼠标速度(2) + 鼠标按键(3)
+        key_names = [None] * len(self.key_map)
+        for key, index in self.key_map.items():
+            key_names[index] = key if isinstance(key, str) else key.name
+        self.state_schema = key_names + [
+            'mouse_x', 'mouse_y', 'mouse_dx', 'mouse_dy',
+            'mouse_left', 'mouse_right', 'mouse_middle'
+        ]
+        self.state_dim = len(self.state_schema)
+        self.position_index = len(self.key_map)
+        self.velocity_index = self.position_index + 2
+        self.button_index = self.position_index + 4
         
-        # 初始化鼠标状态
-        self.mouse_x = 0
-        self.mouse_y = 0
-        self.mouse_dx = 0  # X轴移动速度
-        self.mouse_dy = 0  # Y轴移动速度
-        self.last_mouse_time = time.time()
-        self.mouse_buttons = {
-            'left': 0,
-            'right': 0,
-            'middle': 0
+        # 键盘和鼠标状态由监听线程原地更新，采集线程每帧整体复制一次
+        self.state = StateBlock(self.state_dim)
+        self.mouse_velocity = MouseVelocity(velocity_mode)  # 鼠标移动速度
+        self.button_codes = {
+            mouse.Button.left: 0,
+            mouse.Button.right: 1,
+            mouse.Button.middle: 2
         }
         
+        # 输入事件日志，回调线程写入，写盘线程批量写入 events 数据集
+        self.event_log = EventRing()
+        
         # 初始化录制线程
         self.record_thread = None
         
@@ -68,18 +118,10 @@ class GameRecorder:
         :param x: 鼠标X坐标
         :param y: 鼠标Y坐标
         """
-        current_time = time.time()
-        dt = current_time - self.last_mouse_time
-        
-        # 计算鼠标移动速度
-        if dt > 0:
-            self.mouse_dx = (x - self.mouse_x) / dt
-            self.mouse_dy = (y - self.mouse_y) / dt
-        
-        # 更新鼠标位置和时间
-        self.mouse_x = x
-        self.mouse_y = y
-        self.last_mouse_time = current_time
+        # 更新鼠标位置，速度由估计器按帧汇总
+        self.state.set(self.position_index, x, y)
+        self.mouse_velocity.update(x, y)
+        self.event_log.append(MOUSE_MOVE, x=x, y=y)
 
     def _on_click(self, x, y, button, pressed):
         """
@@ -89,19 +131,18 @@ class GameRecorder:
         :param button: 按键类型
         :param pressed: 是否按下
         """
-        if button == mouse.Button.left:
-            self.mouse_buttons['left'] = 1 if pressed else 0
-        elif button == mouse.Button.right:
-            self.mouse_buttons['right'] = 1 if pressed else 0
-        elif button == mouse.Button.middle:
-            self.mouse_buttons['middle'] = 1 if pressed else 0
+        code = self.button_codes.get(button)
+        if code is None:
+            return
+        self.state.set(self.button_index + code, 1 if pressed else 0)
+        self.event_log.append(MOUSE_CLICK, code, 1 if pressed else 0, x, y)
 
     def _on_scroll(self, x, y, dx, dy):
         """
         处理鼠标滚轮事件
-        暂时不记录滚轮状态，如需要可以扩展
+        滚轮不进入状态向量，只记录到事件日志
         """
-        pass
+        self.event_log.append(MOUSE_SCROLL, dx, dy, x, y)
 
     def _on_press(self, key):
         """
@@ -110,9 +151,13 @@ class GameRecorder:
         """
         try:
             if hasattr(key, 'char') and key.char in self.key_map:
-                self.key_states[self.key_map[key.char]] = 1
+                index = self.key_map[key.char]
             elif key in self.key_map:
-                self.key_states[self.key_map[key]] = 1
+                index = self.key_map[key]
+            else:
+                return
+            self.state.set(index, 1)
+            self.event_log.append(KEY_PRESS, index)
         except:
             pass
 
@@ -123,44 +168,27 @@ class GameRecorder:
         """
         try:
             if hasattr(key, 'char') and key.char in self.key_map:
-                self.key_states[self.key_map[key.char]] = 0
+                index = self.key_map[key.char]
             elif key in self.key_map:
-                self.key_states[self.key_map[key]] = 0
+                index = self.key_map[key]
+            else:
+                return
+            self.state.set(index, 0)
+            self.event_log.append(KEY_RELEASE, index)
         except:
             pass
 
-    def get_mouse_state(self):
+    def get_mouse_state(self, t=None):
         """
         获取当前鼠标状态
+        :param t: 采样时刻，默认为当前时间；'window' 模式下每帧只应调用一次
         :return: 包含位置、速度和按键状态的字典
         """
+        state = self.state.snapshot()
         return {
-            'position': (self.mouse_x, self.mouse_y),
-            'velocity': (self.mouse_dx, self.mouse_dy),
-            'buttons': list(self.mouse_buttons.values())
-        }
-
-    def _get_window_rect(self):
-        """
-        获取窗口位置和大小
-        :return: 包含窗口位置和大小的字典
-        """
-        if self.window_title:
-            hwnd = win32gui.FindWindow(None, self.window_title)
-            if hwnd:
-                rect = win32gui.GetWindowRect(hwnd)
-                return {
-                    'top': rect[1],
-                    'left': rect[0],
-                    'width': rect[2] - rect[0],
-                    'height': rect[3] - rect[1]
-                }
-        # 如果没有指定窗口或找不到窗口，则使用全屏
-        return {
-            'top': 0,
-            'left': 0,
-            'width': 1920,
-            'height': 1080
+            'position': tuple(state[self.position_index:self.velocity_index]),
+            'velocity': self.mouse_velocity.sample(t),
+            'buttons': list(state[self.button_index:])
         }
 
     def toggle_recording(self):
@@ -190,9 +218,48 @@ class GameRecorder:
         录制主循环
         捕获屏幕、键盘和鼠标状态并保存到文件
         """
-        window_rect = self._get_window_rect()
-        h5file = h5py.File(f"{self.output_dir}/record.h5", 'w')
-        frame_count = 0
+        self.manifest = SessionManifest(self.output_dir, self.state_schema, self._capture_settings())
+        # 丢弃录制开始前积累的事件
+        self.event_log.clear()
+        self.mouse_velocity.reset(*self.state.snapshot()[self.position_index:self.velocity_index])
+        self.store = open_store(
+            f"{self.output_dir}/record.h5",
+            frame_shape=(self.target_size[1], self.target_size[0], 3),
+            state_dim=self.state_dim,
+            layout=self.layout,
+            compression=self.compression,
+            dedup_threshold=self.dedup_threshold,
+            sync_interval=self.sync_interval
+        )
+        
+        # 启动写盘线程，采集线程只负责入队
+        self.pipeline = WriterPipeline(
+            self._write_batch,
+            capacity=self.queue_size,
+            num_writers=self.num_writers,
+            policy=self.backpressure,
+            on_drop=self._release_item,
+            max_errors=MAX_WRITE_ERRORS,
+            on_fail=self._on_write_failure
+        ).start()
+        
+        # 预处理结果直接写入缓冲池槽位，写盘后归还
+        num_slots = self.queue_size + self.pipeline.batch_size * self.num_writers + 1
+        if self.process_workers:
+            # 缩放和逐帧编码放到工作进程中执行，结果按顺序送入写盘队列
+            self.frame_pool = ProcessFramePool(
+                self.target_size,
+                num_slots + self.process_workers,
+                num_workers=self.process_workers,
+                codec=self.compression if self.compression in IMAGE_CODECS else None,
+                on_result=self.pipeline.put,
+                state_dim=self.state_dim
+            )
+            state_row = np.zeros(self.state_dim, dtype=np.float32)
+        else:
+            self.frame_pool = FramePool((self.target_size[1], self.target_size[0], 3), num_slots,
+                                        state_dim=self.state_dim)
+            preprocess = FramePreprocessor(self.target_size)
         
         # 启动游戏按键监听
         game_keys = keyboard.Listener(
@@ -200,50 +267,147 @@ class GameRecorder:
             on_release=self._on_release)
         game_keys.start()
         
-        with mss.mss() as sct:
+        # 按绝对截止时间定频采集
+        scheduler = FrameScheduler(self.interval, policy=self.schedule_policy).start()
+        
+        with self.capture:
+            self.manifest.settings['capture_rect'] = self.capture.rect
+            self.manifest.save()
+            # 记录采集区域，回放和训练时据此把鼠标坐标映射到画面坐标
+            self.store.set_geometry(self.capture.rect, self.target_size)
             while self.is_recording and not self.stop_flag.is_set():
                 try:
-                    # 捕获并处理画面
-                    frame = np.array(sct.grab(window_rect))
-                    frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
-                    frame = cv2.resize(frame, self.target_size)
-                    
-                    # 获取当前鼠标状态
-                    mouse_state = self.get_mouse_state()
+                    tick = scheduler.wait(self.stop_flag)
+                    if tick is None:
+                        break
                     
-                    # 创建状态数组
-                    state_array = np.array(
-                        self.key_states +  # 键盘状态
-                        list(mouse_state['position']) +  # 鼠标位置
-                        list(mouse_state['velocity']) +  # 鼠标速度
-                        mouse_state['buttons'],  # 鼠标按键状态
-                        dtype=np.float32
-                    )
+                    # 捕获画面
+                    src = self.capture.grab()
                     
-                    # 保存画面和状态数据
-                    h5file.create_dataset(f"frame_{frame_count}_x", data=frame)
-                    h5file.create_dataset(f"frame_{frame_count}_y", data=state_array)
+                    # 状态向量一次复制到槽位对应的行，再填入本帧的鼠标速度
+                    if self.process_workers:
+                        state = state_row
+                    else:
+                        slot = self.frame_pool.acquire()
+                        state = self.frame_pool.states[slot]
+                    self.state.snapshot(state)
+                    state[self.velocity_index:self.button_index] = self.mouse_velocity.sample(tick.actual)
                     
-                    frame_count += 1
-                    time.sleep(0.03)  # ≈30 FPS
+                    # 缩放并去掉 alpha 通道后写入缓冲池槽位，放入写盘队列，
+                    # 同时记录实际采集时间和计划采集时间
+                    if self.process_workers:
+                        self.frame_pool.submit(src, state, tick.actual, tick.scheduled)
+                    else:
+                        preprocess(src, self.frame_pool[slot])
+                        self.pipeline.put((slot, state, tick.actual, tick.scheduled, None))
                     
                 except Exception as e:
                     print(f"录制出错: {e}")
                     break
         
-        h5file.close()
-        game_keys.stop()
+        # 等待工作进程和写盘队列处理完后关闭文件，中途出错也要关闭文件并写入清单
+        try:
+            if self.process_workers:
+                self.frame_pool.stop()
+            self.pipeline.stop()
+            stats = self.pipeline.stats()
+            print(f"写入 {stats['written']} 帧, 丢弃 {stats['dropped']} 帧, 最大队列深度 {stats['max_depth']}, "
+                  f"跳过 {scheduler.skipped} 个采集时刻")
+        finally:
+            self._close_store()
+            if self.process_workers:
+                self.frame_pool.close()
+            game_keys.stop()
 
-    def quit_program(self):
+    def _capture_settings(self):
         """
-        退出程序
-        停止所有录制和监听
+        采集设置，写入会话清单
+        """
+        return {
+            'target_size': list(self.target_size),
+            'interval': self.interval,
+            'layout': self.layout,
+            'compression': self.compression,
+            'schedule_policy': self.schedule_policy,
+            'backpressure': self.backpressure,
+            'velocity_mode': self.mouse_velocity.mode,
+            'dedup_threshold': self.dedup_threshold,
+            'sync_interval': self.sync_interval,
+        }
+
+    def _close_store(self):
+        """
+        关闭当前分片并登记到会话清单
         """
+        self.store.append_events(self.event_log.drain())
+        self.store.close()
+        self.manifest.add_shard(**self.store.info())
+        self.manifest.save()
+        self.store = None
+
+    def _write_batch(self, items):
+        """
+        写盘线程回调，把一批数据写入文件
+        :param items: (slot, state, timestamp, scheduled, encoded) 列表，slot 为缓冲池槽位
+        """
+        # 写入出错时也要归还这一批的全部槽位，否则采集线程会在 acquire() 上一直等待
+        try:
+            for slot, state, timestamp, scheduled, encoded in items:
+                self.store.append(self.frame_pool[slot], state, timestamp, scheduled, encoded)
+            # 顺便把这段时间的输入事件批量写入
+            self.store.append_events(self.event_log.drain())
+        finally:
+            for item in items:
+                self.frame_pool.release(item[0])
+
+    def _on_write_failure(self, error):
+        """
+        写盘连续出错时停止录制，不再继续采集写不进去的画面
+        """
+        print(f"连续 {MAX_WRITE_ERRORS} 批写入失败, 停止录制: {error}")
+        self.is_recording = False
+        self.stop_flag.set()
+
+    def _release_item(self, item):
+        """
+        被丢弃的数据项归还其缓冲池槽位
+        """
+        self.frame_pool.release(item[0])
+
+    def shutdown(self, timeout=None):
+        """
+        有序退出：停止采集，排空工作进程和写盘队列，关闭分片并写入清单，最后停止监听
+        排空由录制线程完成（见 record_loop 结尾），这里只等待它结束
+        :param timeout: 等待的最长时间（秒），None 使用 shutdown_timeout
+        :return: 是否在超时前完成
+        """
+        timeout = self.shutdown_timeout if timeout is None else timeout
         self.is_recording = False
         self.stop_flag.set()
-        if self.record_thread:
-            self.record_thread.join()
-        os._exit(0)
+        done = True
+        if self.record_thread is not None and self.record_thread.is_alive():
+            print("正在停止录制并写入剩余数据...")
+            self.record_thread.join(timeout)
+            done = not self.record_thread.is_alive()
+        self.mouse_listener.stop()
+        self.hotkey_listener.stop()
+        if done and self.manifest is not None:
+            print(f"已保存 {self.manifest.num_frames} 帧, {len(self.manifest.shards)} 个分片, "
+                  f"清单: {self.manifest.path}")
+        elif not done and self.pipeline is not None:
+            stats = self.pipeline.stats()
+            print(f"等待写盘超时: 已写入 {stats['written']} 帧, 队列中还有 {stats['depth']} 帧; "
+                  f"未关闭的分片可用 recover.py 恢复")
+        return done
+
+    def quit_program(self):
+        """
+        退出程序
+        先按 shutdown() 写完剩余数据，再结束进程（采集后端和监听线程不一定能自行退出）
+        """
+        done = self.shutdown()
+        sys.stdout.flush()
+        os._exit(0 if done else 1)
 
     def start(self):
         """
@@ -0,0 +1,267 @@
+import argparse
+import os
+from glob import glob
+
+import h5py
+import numpy as np
+
+from manifest import SessionManifest
+from storage import MemmapFrameStore, shard_files
+
+# 连续布局中与帧一一对应、按行对齐的数据集
+ROW_DATASETS = ('states', 'timestamps', 'scheduled', 'frame_index')
+
+
+def _stored_rows(f, n):
+    """
+    前 n 行引用的 frames 行数（去重录制按 frame_index 计算）
+    """
+    if n == 0:
+        return 0
+    if 'frame_index' in f:
+        return int(f['frame_index'][n - 1]) + 1
+    return n
+
+
+def _readable(f, n):
+    """
+    第 n-1 行的各个数据集能否正常读出
+    """
+    try:
+        for name in ROW_DATASETS:
+            if name in f:
+                f[name][n - 1]
+        f['frames'][_stored_rows(f, n) - 1]
+    except OSError:
+        return False
+    return True
+
+
+def _contiguous_length(f):
+    """
+    连续布局中最后一次完整写入后的帧数
+    """
+    n = min(f[name].shape[0] for name in ROW_DATASETS if name in f)
+    if 'frame_count' in f.attrs:
+        n = min(n, int(f.attrs['frame_count']))
+    stored = f['frames'].shape[0]
+    if 'frame_index' in f:
+        # 行号单调不减，只保留引用的画面已写入的行
+        n = int(np.searchsorted(f['frame_index'][:n], stored))
+    else:
+        n = min(n, stored)
+    # 末尾的分块可能没有完整写入文件，逐块后退直到能读出
+    step = f['states'].chunks[0] if f['states'].chunks else 1
+    while n > 0 and not _readable(f, n):
+        n = (n - 1) // step * step
+    return n
+
+
+def _truncate_contiguous(f, n):
+    stored = _stored_rows(f, n)
+    for name in ROW_DATASETS:
+        if name in f:
+            f[name].resize(n, axis=0)
+    f['frames'].resize(stored, axis=0)
+    f.attrs['frame_count'] = n
+
+
+def _memmap_written(path, attrs):
+    """
+    times 数组中已写入的行数
+    每帧的时间在画面和状态之后写入，第一个时间为 0 的行之前的行都是完整的
+    """
+    times_path = os.path.join(os.path.dirname(path), attrs['times_file'])
+    rows = os.path.getsize(times_path) // 16
+    if rows == 0:
+        return 0
+    times = np.memmap(times_path, dtype=np.float64, mode='r', shape=(rows, 2))
+    unwritten = np.flatnonzero(times[:, 0] == 0)
+    return int(unwritten[0]) if len(unwritten) else rows
+
+
+def _memmap_length(path, f):
+    """
+    内存映射布局中可以恢复的帧数，同时受数组文件大小限制
+    有 times 数组时以它为准（元数据文件中的 timestamps 可能还没写入最后几批），
+    否则以 frame_count 和 timestamps 为准
+    """
+    attrs = f.attrs
+    frame_bytes = int(np.prod(attrs['frame_shape']))
+    state_bytes = int(attrs['state_dim']) * 4
+    base = os.path.dirname(path)
+    if 'times_file' in attrs:
+        n = _memmap_written(path, attrs)
+    else:
+        n = min(f['timestamps'].shape[0], f['scheduled'].shape[0])
+        if 'frame_count' in attrs:
+            n = min(n, int(attrs['frame_count']))
+    n = min(n, os.path.getsize(os.path.join(base, attrs['frames_file'])) // frame_bytes,
+            os.path.getsize(os.path.join(base, attrs['states_file'])) // state_bytes)
+    return n
+
+
+def _truncate_memmap(path, f, n):
+    attrs = f.attrs
+    base = os.path.dirname(path)
+    for name in ('timestamps', 'scheduled'):
+        f[name].resize(n, axis=0)
+    if 'times_file' in attrs:
+        # 由 times 数组重建 timestamps 和 scheduled
+        times_path = os.path.join(base, attrs['times_file'])
+        if n:
+            times = np.memmap(times_path, dtype=np.float64, mode='r', shape=(n, 2))
+            f['timestamps'][:] = times[:, 0]
+            f['scheduled'][:] = times[:, 1]
+            del times
+        os.truncate(times_path, n * 16)
+    os.truncate(os.path.join(base, attrs['frames_file']), n * int(np.prod(attrs['frame_shape'])))
+    os.truncate(os.path.join(base, attrs['states_file']), n * int(attrs['state_dim']) * 4)
+    attrs['frame_count'] = n
+
+
+def _legacy_length(f):
+    """
+    逐帧布局中画面和状态都完整的连续帧数
+    """
+    n = 0
+    while f"frame_{n}_x" in f and f"frame_{n}_y" in f:
+        n += 1
+    if 'frame_count' in f.attrs:
+        n = min(n, int(f.attrs['frame_count']))
+    while n > 0:
+        try:
+            f[f"frame_{n - 1}_x"][()]
+            f[f"frame_{n - 1}_y"][()]
+            break
+        except OSError:
+            n -= 1
+    return n
+
+
+def _truncate_legacy(f, n):
+    i = n
+    while f"frame_{i}_x" in f or f"frame_{i}_y" in f:
+        for key in (f"frame_{i}_x", f"frame_{i}_y"):
+            if key in f:
+                del f[key]
+        i += 1
+
+
+def _shard_info(path, f, n):
+    """
+    恢复后的分片信息，用于登记到会话清单
+    """
+    layout = f.attrs.get('layout', 'legacy')
+    info = {'path': path, 'frames': n, 'layout': layout, 'recovered': True}
+    if 'timestamps' in f and n and f['timestamps'].shape[0] >= n:
+        info['first_timestamp'] = float(f['timestamps'][0])
+        info['last_timestamp'] = float(f['timestamps'][n - 1])
+    if 'frames' in f:
+        info['compression'] = f['frames'].attrs.get('codec', 'none')
+    elif layout == 'legacy' and n:
+        info['compression'] = f['frame_0_x'].compression or 'none'
+    else:
+        info['compression'] = 'none'
+    return info
+
+
+def recover_shard(path, dry_run=False):
+    """
+    把未正常关闭的分片截断到最后一次完整写入的批次
+    以文件属性 frame_count 为上限，再按各数据集的实际行数和可读性向前收缩；
+    文件元数据已经损坏、h5py 无法打开时抛出 OSError。
+    :param path: 分片路径
+    :param dry_run: 只检查，不修改文件
+    :return: (分片信息字典, 截掉的行数)
+    """
+    with h5py.File(path, 'r' if dry_run else 'r+') as f:
+        if f.attrs.get('layout') == MemmapFrameStore.layout:
+            n = _memmap_length(path, f)
+            rows = max(f['timestamps'].shape[0], n)
+            if not dry_run:
+                _truncate_memmap(path, f, n)
+        elif 'frames' in f:
+            rows = f['states'].shape[0]
+            n = _contiguous_length(f)
+            if not dry_run:
+                _truncate_contiguous(f, n)
+        else:
+            rows = sum(1 for key in f.keys() if key.endswith('_y'))
+            n = _legacy_length(f)
+            if not dry_run:
+                _truncate_legacy(f, n)
+                f.attrs['frame_count'] = n
+        return _shard_info(path, f, n), rows - n
+
+
+def is_unused(path):
+    """
+    分片是否从未写入过任何数据（如轮换时预先创建、还没启用的分片）
+    只检查数据本身：没有任何行、没有输入事件，内存映射布局的 times 数组中没有写入的行；
+    没有 times 数组的旧内存映射分片无法判断，视为已使用
+    :param path: 分片路径
+    """
+    with h5py.File(path, 'r') as f:
+        if 'events' in f and f['events'].shape[0] > 0:
+            return False
+        if f.attrs.get('layout') == MemmapFrameStore.layout:
+            return ('times_file' in f.attrs and f['timestamps'].shape[0] == 0
+                    and _memmap_written(path, f.attrs) == 0)
+        if 'frames' in f:
+            return all(f[name].shape[0] == 0 for name in ('frames',) + ROW_DATASETS if name in f)
+        return not any(key.startswith('frame_') for key in f.keys())
+
+
+def recover_session(session_dir, dry_run=False):
+    """
+    恢复会话目录中没有登记到清单的分片（即没有正常关闭的分片），并补登到清单
+    :param session_dir: 会话目录
+    :param dry_run: 只检查，不修改文件和清单
+    :return: SessionManifest
+    """
+    if SessionManifest.exists(session_dir):
+        manifest = SessionManifest.load(session_dir)
+    else:
+        manifest = SessionManifest(session_dir)
+    listed = {os.path.normpath(p) for p in manifest.shard_paths()}
+    changed = False
+    for path in sorted(glob(os.path.join(session_dir, '*.h5'))):
+        if os.path.normpath(path) in listed:
+            continue
+        try:
+            # 截断前判断，截断后的分片都没有数据行
+            unused = is_unused(path)
+            info, dropped = recover_shard(path, dry_run)
+        except OSError as e:
+            print(f"无法打开分片, 元数据已损坏: {path}: {e}")
+            continue
+        if info['frames'] > 0:
+            print(f"{path}: 保留 {info['frames']} 帧, 截掉 {dropped} 行")
+            manifest.add_shard(**info)
+            changed = True
+        elif unused:
+            # 只删除从未写入过数据的分片（如轮换时预先创建的分片）
+            print(f"{path}: 未使用的分片" + ("" if dry_run else ", 已删除"))
+            if not dry_run:
+                for f in shard_files(path):
+                    os.remove(f)
+        else:
+            print(f"{path}: 没有可恢复的完整帧, 保留文件, 未登记到清单")
+    if changed and not dry_run:
+        manifest.shards.sort(key=lambda s: s['path'])
+        manifest.save()
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="恢复录制进程异常退出后留下的分片")
+    parser.add_argument('paths', nargs='+', help="会话目录或分片路径")
+    parser.add_argument('--dry-run', action='store_true', help="只检查，不修改文件")
+    args = parser.parse_args()
+    for path in args.paths:
+        if os.path.isdir(path):
+            recover_session(path, args.dry_run)
+        else:
+            info, dropped = recover_shard(path, args.dry_run)
+            print(f"{path}: 保留 {info['frames']} 帧, 截掉 {dropped} 行")
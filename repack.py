@@ -0,0 +1,201 @@
+import argparse
+import math
+import multiprocessing as mp
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import h5py
+import numpy as np
+
+from codec import COMPRESSIONS
+from dataset import Recording, find_shards
+from manifest import SessionManifest
+from storage import FrameStore
+
+# 输出文件中记录来源的属性
+SOURCE_ATTR = 'repacked_from'
+SOURCE_FRAMES_ATTR = 'source_frames'
+# 从输入文件原样复制的属性
+COPY_ATTRS = ('capture_rect', 'target_size', 'screen_to_frame')
+
+
+def _output_name(path, root):
+    """
+    输出文件名：相对公共根目录的路径，目录分隔符换成下划线，避免不同会话的同名分片冲突
+    """
+    rel = os.path.relpath(path, root) if root else os.path.basename(path)
+    return rel.replace(os.sep, '_').replace('/', '_')
+
+
+def _source_length(path):
+    with Recording(path) as rec:
+        return len(rec)
+
+
+def is_repacked(src, dst):
+    """
+    判断 dst 是否已是 src 完整转换的结果（帧数一致）
+    """
+    if not os.path.isfile(dst):
+        return False
+    try:
+        with h5py.File(dst, 'r') as f:
+            done = int(f.attrs.get(SOURCE_FRAMES_ATTR, -1))
+            written = f['states'].shape[0] if 'states' in f else -1
+    except OSError:
+        return False
+    return done == written == _source_length(src)
+
+
+def repack_shard(src, dst, compression='lzf', chunk_frames=64, keyframe_interval=30):
+    """
+    把一个分片转换为连续布局，在工作进程中执行
+    按 chunk_frames 分块流式读取和写入，内存占用与分片大小无关；
+    先写临时文件，校验帧数后再替换为正式文件，中断时不会留下看似完整的结果。
+    :param src: 输入分片（逐帧或连续布局）
+    :param dst: 输出路径
+    :param compression: 画面压缩方式
+    :param chunk_frames: 输出 frames 数据集的分块帧数，同时是每次读写的帧数
+    :param keyframe_interval: 差分编码的关键帧间隔
+    :return: 分片信息字典
+    """
+    tmp = dst + '.tmp'
+    with Recording(src, chunk_size=chunk_frames) as rec:
+        n = len(rec)
+        if n == 0:
+            raise ValueError(f"空分片: {src}")
+        times = rec.h5file['timestamps'] if 'timestamps' in rec.h5file else None
+        scheduled = rec.h5file['scheduled'] if 'scheduled' in rec.h5file else None
+        store = FrameStore(tmp, rec.frame_shape, rec.state_dim, batch_size=chunk_frames,
+                           compression=compression, keyframe_interval=keyframe_interval,
+                           chunk_frames=chunk_frames)
+        try:
+            for start in range(0, n, chunk_frames):
+                stop = min(start + chunk_frames, n)
+                frames, states = rec[start:stop]
+                # 旧文件没有时间戳，记为 NaN
+                ts = times[start:stop] if times is not None else np.full(stop - start, np.nan)
+                sched = scheduled[start:stop] if scheduled is not None else ts
+                for i in range(stop - start):
+                    store.append(frames[i], states[i], ts[i], sched[i])
+            if 'events' in rec.h5file:
+                events = rec.h5file['events']
+                for start in range(0, events.shape[0], 65536):
+                    store.append_events(events[start:start + 65536])
+            for key in COPY_ATTRS:
+                if key in rec.h5file.attrs:
+                    store.h5file.attrs[key] = rec.h5file.attrs[key]
+            store.h5file.attrs[SOURCE_ATTR] = os.path.abspath(src)
+            store.h5file.attrs[SOURCE_FRAMES_ATTR] = n
+            info = store.info()
+        finally:
+            store.close()
+
+    with Recording(tmp) as out:
+        if len(out) != n:
+            raise ValueError(f"帧数校验失败: {src} 有 {n} 帧, 输出 {len(out)} 帧")
+    os.replace(tmp, dst)
+    info['path'] = dst
+    return info
+
+
+def _clean_info(info):
+    """
+    清单中不能出现 NaN，未知的时间戳记为 None
+    """
+    for key in ('first_timestamp', 'last_timestamp'):
+        value = info.get(key)
+        if value is not None and math.isnan(value):
+            info[key] = None
+    return info
+
+
+def repack(paths, out_dir, compression='lzf', chunk_frames=64, keyframe_interval=30,
+           workers=None, resume=True):
+    """
+    批量转换录制分片，每个分片一个工作进程，完成后写入输出目录的会话清单
+    :param paths: 分片路径、会话目录或通配符，或它们的列表
+    :param out_dir: 输出目录
+    :param compression: 画面压缩方式
+    :param chunk_frames: 分块帧数
+    :param keyframe_interval: 差分编码的关键帧间隔
+    :param workers: 并行进程数，None 使用 CPU 核数
+    :param resume: 跳过输出目录中已完整转换的分片
+    :return: SessionManifest
+    """
+    shards = find_shards(paths)
+    if not shards:
+        raise ValueError("没有找到录制分片")
+    os.makedirs(out_dir, exist_ok=True)
+    root = os.path.commonpath([os.path.abspath(p) for p in shards]) if len(shards) > 1 else None
+    targets = [os.path.join(out_dir, _output_name(os.path.abspath(p), root)) for p in shards]
+
+    # 状态结构取自第一个有清单的输入会话
+    schema = None
+    for path in shards:
+        session = os.path.dirname(path)
+        if SessionManifest.exists(session):
+            schema = SessionManifest.load(session).state_schema
+            break
+    manifest = SessionManifest(out_dir, schema, {
+        'compression': compression,
+        'chunk_frames': chunk_frames,
+        'keyframe_interval': keyframe_interval,
+    })
+
+    infos = [None] * len(shards)
+    todo = []
+    for k, (src, dst) in enumerate(zip(shards, targets)):
+        if resume and is_repacked(src, dst):
+            with Recording(dst) as rec:
+                info = {'path': dst, 'frames': len(rec), 'layout': FrameStore.layout,
+                        'compression': compression}
+                ts = rec.timestamps
+                if ts is not None and len(ts):
+                    info['first_timestamp'] = float(ts[0])
+                    info['last_timestamp'] = float(ts[-1])
+            infos[k] = info
+            print(f"跳过已转换的分片: {src}")
+        else:
+            todo.append(k)
+
+    failed = 0
+    ctx = mp.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), mp_context=ctx) as pool:
+        futures = {
+            pool.submit(repack_shard, shards[k], targets[k], compression, chunk_frames,
+                        keyframe_interval): k
+            for k in todo
+        }
+        for future in as_completed(futures):
+            k = futures[future]
+            try:
+                infos[k] = future.result()
+                print(f"[{sum(i is not None for i in infos)}/{len(shards)}] "
+                      f"{shards[k]} -> {targets[k]} ({infos[k]['frames']} 帧)")
+            except Exception as e:
+                failed += 1
+                print(f"转换失败: {shards[k]}: {e}")
+
+    for info in infos:
+        if info is not None:
+            manifest.add_shard(**_clean_info(info))
+    manifest.save()
+    print(f"完成 {len(manifest.shards)}/{len(shards)} 个分片, 共 {manifest.num_frames} 帧, "
+          f"失败 {failed} 个")
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="把录制分片（含旧版逐帧布局）转换为连续分块布局")
+    parser.add_argument('paths', nargs='+', help="分片路径、会话目录或通配符")
+    parser.add_argument('-o', '--out-dir', required=True, help="输出目录")
+    parser.add_argument('--compression', choices=COMPRESSIONS, default='lzf')
+    parser.add_argument('--chunk-frames', type=int, default=64, help="frames 数据集每个分块的帧数")
+    parser.add_argument('--keyframe-interval', type=int, default=30, help="差分编码的关键帧间隔")
+    parser.add_argument('--workers', type=int, default=None, help="并行进程数，默认 CPU 核数")
+    parser.add_argument('--no-resume', dest='resume', action='store_false',
+                        help="重新转换所有分片，不跳过已完成的输出")
+    args = parser.parse_args()
+    repack(args.paths, args.out_dir, args.compression, args.chunk_frames,
+           args.keyframe_interval, args.workers, args.resume)
@@ -0,0 +1,142 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from dataset import Recording
+from storage import shard_files
+
+
+class ShardRotator:
+    """
+    录制分片的后台轮换
+    下一个分片在后台线程中提前创建；轮换时写盘线程只交换存储对象，
+    旧分片的收尾（写入剩余缓冲、关闭文件、登记会话清单、可选的帧数校验）
+    交给同一个后台线程按顺序完成，写盘线程不会因为关闭大文件而停顿。
+    满足 frame_limit（帧数）、max_bytes（已写盘字节数）、max_seconds（采集时长）
+    中任意一个条件即轮换，未设置的条件不检查。
+    清单只在后台线程中修改和保存，分片按轮换顺序登记。
+    """
+
+    def __init__(self, open_shard, manifest, frame_limit=None, max_bytes=None, max_seconds=None,
+                 verify=False):
+        """
+        :param open_shard: 创建分片存储的函数 open_shard(index)，index 为分片序号
+        :param manifest: SessionManifest，分片关闭后登记到其中
+        :param frame_limit: 每个分片的最大帧数
+        :param max_bytes: 每个分片的最大字节数
+        :param max_seconds: 每个分片的最长采集时长（秒）
+        :param verify: 关闭后重新打开分片校验帧数
+        """
+        self.open_shard = open_shard
+        self.manifest = manifest
+        self.frame_limit = frame_limit
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.verify = verify
+        self.store = None
+        self.index = 0
+        self._executor = None
+        self._next = None
+        self._pending = []
+
+    def start(self):
+        """
+        同步创建第一个分片，并在后台预先创建下一个
+        :return: self
+        """
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shard-rotator")
+        self.store = self.open_shard(self.index)
+        self._next = self._executor.submit(self.open_shard, self.index + 1)
+        return self
+
+    def due(self):
+        """
+        当前分片是否达到轮换条件
+        """
+        store = self.store
+        if self.frame_limit and len(store) >= self.frame_limit:
+            return True
+        if (self.max_seconds and store.first_timestamp is not None
+                and store.last_timestamp - store.first_timestamp >= self.max_seconds):
+            return True
+        return bool(self.max_bytes) and store.size_bytes() >= self.max_bytes
+
+    def rotate(self):
+        """
+        切换到预先创建的分片，旧分片交给后台线程收尾
+        :return: 新的当前存储
+        """
+        old = self.store
+        # 下一个分片通常早已创建好，只有轮换过于频繁时才需要等待
+        self.store = self._next.result()
+        self.index += 1
+        self._pending = [f for f in self._pending if not f.done()]
+        self._pending.append(self._executor.submit(self._finalize, old))
+        self._next = self._executor.submit(self.open_shard, self.index + 1)
+        return self.store
+
+    def _finalize(self, store):
+        """
+        后台线程：关闭分片并登记到会话清单
+        """
+        try:
+            store.close()
+            info = store.info()
+            if self.verify:
+                with Recording(store.path) as rec:
+                    frames = len(rec)
+                info['verified'] = frames == info['frames']
+                if not info['verified']:
+                    print(f"分片校验失败: {store.path} 应有 {info['frames']} 帧, 实际 {frames} 帧")
+            self.manifest.add_shard(**info)
+            self.manifest.save()
+        except Exception as e:
+            print(f"关闭分片出错: {store.path}: {e}")
+
+    def _remove(self, store):
+        """
+        关闭并删除没有写入任何帧的分片，不登记到清单
+        """
+        store.close()
+        for path in shard_files(store.path):
+            os.remove(path)
+
+    def _discard(self, future):
+        """
+        删除预先创建但没有使用的分片
+        """
+        if future.cancel():
+            return
+        try:
+            store = future.result()
+        except Exception:
+            return
+        self._remove(store)
+
+    def _drop_empty(self, store):
+        """
+        后台线程：删除停止录制时还没有写入帧的当前分片（如刚在轮换边界切换过去），
+        仍然保存清单，没有任何帧的会话也留下清单文件
+        """
+        try:
+            self._remove(store)
+            self.manifest.save()
+        except Exception as e:
+            print(f"删除空分片出错: {store.path}: {e}")
+
+    def close(self):
+        """
+        收尾当前分片，等待后台任务全部完成
+        当前分片没有写入任何帧时删除，不登记到清单
+        """
+        if self._executor is None:
+            return
+        self._discard(self._next)
+        self._next = None
+        finish = self._finalize if len(self.store) else self._drop_empty
+        self._pending.append(self._executor.submit(finish, self.store))
+        for future in self._pending:
+            future.result()
+        self._pending = []
+        self._executor.shutdown()
+        self._executor = None
+        self.store = None
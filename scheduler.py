@@ -0,0 +1,111 @@
+import time
+from collections import namedtuple
+
+# 错过截止时间后的处理策略
+CATCH_UP = 'catch_up'  # 立即连续补采错过的帧
+SKIP = 'skip'          # 跳过错过的帧，对齐到下一个截止时间
+POLICIES = (CATCH_UP, SKIP)
+
+# 截止时间前最后这段时间改为忙等，弥补 sleep 的精度不足（Windows 约 15ms）
+SPIN_SECONDS = 0.002
+
+# 进程内统一的时间基准：用 perf_counter 的精度、对齐到 time.time() 的时间轴
+# （Windows 上 time.time() 的分辨率可能只有约 15ms）
+_PERF0 = time.perf_counter()
+_WALL0 = time.time()
+
+
+def now():
+    """
+    高精度的当前时间，与 time.time() 同一时间轴
+    画面时间戳和输入事件时间戳都使用它，二者可以直接比较
+    """
+    return _WALL0 + (time.perf_counter() - _PERF0)
+
+
+# index: 帧序号; scheduled: 计划采集时间; actual: 实际采集时间（均为 time.time() 时间轴）
+Tick = namedtuple('Tick', ['index', 'scheduled', 'actual'])
+
+
+class FrameScheduler:
+    """
+    基于绝对截止时间的定频采集调度器
+    第 n 帧的截止时间为 t0 + n * interval（time.perf_counter 时间轴），
+    处理耗时不会累积成帧率漂移。
+    """
+
+    def __init__(self, interval, policy=SKIP):
+        """
+        :param interval: 采集间隔（秒），为 0 时不限速
+        :param policy: 错过截止时间时的策略 'catch_up' / 'skip'
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"未知的调度策略: {policy}")
+        self.interval = interval
+        self.policy = policy
+        self.skipped = 0
+        self.late = 0
+        self._index = 0
+        self._t0 = None
+
+    def start(self):
+        """
+        以当前时刻为第0帧的截止时间开始调度
+        """
+        self._t0 = time.perf_counter()
+        self._index = 0
+        self.skipped = 0
+        self.late = 0
+        return self
+
+    def to_wall(self, t):
+        """
+        把 perf_counter 时间换算到 time.time() 时间轴
+        """
+        return _WALL0 + (t - _PERF0)
+
+    def wait(self, stop_event=None):
+        """
+        等待下一帧的截止时间
+        :param stop_event: 可选的停止事件，等待期间被设置则提前返回
+        :return: Tick，若等待期间收到停止信号则返回 None
+        """
+        if self._t0 is None:
+            self.start()
+        deadline = self._t0 + self._index * self.interval
+        now = time.perf_counter()
+
+        if now < deadline:
+            remaining = deadline - now - SPIN_SECONDS
+            if remaining > 0:
+                if stop_event is not None:
+                    if stop_event.wait(remaining):
+                        return None
+                else:
+                    time.sleep(remaining)
+            while time.perf_counter() < deadline:
+                pass
+        elif self.interval > 0 and now - deadline >= self.interval:
+            # 已落后至少一整帧
+            self.late += 1
+            if self.policy == SKIP:
+                missed = int((now - deadline) // self.interval)
+                self._index += missed
+                self.skipped += missed
+                deadline = self._t0 + self._index * self.interval
+
+        index = self._index
+        self._index += 1
+        return Tick(index, self.to_wall(deadline), self.to_wall(time.perf_counter()))
+
+    def ticks(self, stop_event=None):
+        """
+        按截止时间依次产生 Tick 的迭代器
+        :param stop_event: 可选的停止事件
+        """
+        self.start()
+        while stop_event is None or not stop_event.is_set():
+            tick = self.wait(stop_event)
+            if tick is None:
+                break
+            yield tick
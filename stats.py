@@ -0,0 +1,157 @@
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from dataset import Recording, find_shards
+from geometry import MOUSE_DIM
+
+
+class StateStats:
+    """
+    控制状态的流式统计：按键使用次数、鼠标移动总距离、平均速度、鼠标按键点击次数
+    update() 依次接收连续的状态块，块之间的差分（移动距离、按下沿）由保存的
+    上一块最后一帧补上，结果与一次性处理整段数组相同；
+    merge() 把紧接在后面的另一段统计合并进来，可以按分片并行统计后再按顺序合并。
+    内存占用与总帧数无关。
+    """
+
+    def __init__(self, num_keys, num_buttons=3):
+        """
+        :param num_keys: 按键数量
+        :param num_buttons: 鼠标按键数量
+        """
+        self.num_keys = num_keys
+        self.num_buttons = num_buttons
+        self.num_frames = 0
+        self.key_usage = np.zeros(num_keys, dtype=np.float64)
+        self.total_distance = 0.0
+        self.speed_sum = 0.0
+        self.button_clicks = np.zeros(num_buttons, dtype=np.int64)
+        self.first = None
+        self.last = None
+
+    def _edge(self, prev, cur):
+        """
+        两帧之间的移动距离和按键按下沿
+        """
+        k = self.num_keys
+        step = np.asarray(cur[k:k+2], dtype=np.float64) - prev[k:k+2]
+        pressed = cur[k+4:k+4+self.num_buttons] > prev[k+4:k+4+self.num_buttons]
+        return float(np.sqrt(np.sum(step ** 2))), pressed
+
+    def update(self, states):
+        """
+        累加一块紧接在已处理数据之后的状态
+        :param states: (N, D) 状态数组
+        :return: self
+        """
+        states = np.asarray(states)
+        if len(states) == 0:
+            return self
+        k = self.num_keys
+        positions = states[:, k:k+2].astype(np.float64)
+        velocities = states[:, k+2:k+4].astype(np.float64)
+        buttons = states[:, k+4:k+4+self.num_buttons]
+
+        self.key_usage += states[:, :k].sum(axis=0, dtype=np.float64)
+        self.total_distance += float(np.sum(np.sqrt(np.sum(np.diff(positions, axis=0) ** 2, axis=1))))
+        self.speed_sum += float(np.sum(np.sqrt(np.sum(velocities ** 2, axis=1))))
+        self.button_clicks += np.sum(np.diff(buttons, axis=0) > 0, axis=0)
+        if self.last is not None:
+            distance, pressed = self._edge(self.last, states[0])
+            self.total_distance += distance
+            self.button_clicks += pressed
+        if self.first is None:
+            self.first = states[0].copy()
+        self.last = states[-1].copy()
+        self.num_frames += len(states)
+        return self
+
+    def merge(self, other):
+        """
+        合并时间上紧接在本段之后的另一段统计
+        :param other: StateStats
+        :return: self
+        """
+        if other.num_frames == 0:
+            return self
+        if self.last is not None:
+            distance, pressed = self._edge(self.last, other.first)
+            self.total_distance += distance
+            self.button_clicks += pressed
+        else:
+            self.first = other.first
+        self.last = other.last
+        self.num_frames += other.num_frames
+        self.key_usage += other.key_usage
+        self.total_distance += other.total_distance
+        self.speed_sum += other.speed_sum
+        self.button_clicks += other.button_clicks
+        return self
+
+    @property
+    def key_frequency(self):
+        """
+        各按键按下的帧数占比（%）
+        """
+        return self.key_usage / max(self.num_frames, 1) * 100
+
+    @property
+    def avg_velocity(self):
+        """
+        平均鼠标移动速度（像素/秒）
+        """
+        return self.speed_sum / self.num_frames if self.num_frames else 0.0
+
+    @classmethod
+    def from_states(cls, states, num_keys, chunk_size=65536):
+        """
+        分块统计内存中的状态数组
+        """
+        stats = cls(num_keys)
+        for i in range(0, len(states), chunk_size):
+            stats.update(states[i:i + chunk_size])
+        return stats
+
+
+def shard_stats(path, num_keys=None, chunk_size=65536):
+    """
+    分块读取一个分片的状态并统计，不读取画面
+    :param path: 分片路径
+    :param num_keys: 按键数量，None 时由状态维度推算
+    :param chunk_size: 每次读取的帧数
+    :return: StateStats
+    """
+    with Recording(path) as rec:
+        if num_keys is None:
+            num_keys = (rec.state_dim or MOUSE_DIM) - MOUSE_DIM
+        stats = StateStats(num_keys)
+        for i in range(0, len(rec), chunk_size):
+            stats.update(rec.read_states(slice(i, i + chunk_size)))
+    return stats
+
+
+def session_stats(paths, num_keys=None, workers=1, chunk_size=65536):
+    """
+    统计一个或多个会话的全部分片，分片按时间顺序视为连续的一段
+    :param paths: 分片路径、会话目录或通配符，或它们的列表
+    :param num_keys: 按键数量，None 时由状态维度推算
+    :param workers: 并行统计的进程数，1 表示在当前进程中依次统计
+    :param chunk_size: 每次读取的帧数
+    :return: StateStats
+    """
+    shards = find_shards(paths)
+    if workers > 1 and len(shards) > 1:
+        ctx = mp.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=min(workers, len(shards)), mp_context=ctx) as pool:
+            parts = list(pool.map(shard_stats, shards, [num_keys] * len(shards),
+                                  [chunk_size] * len(shards)))
+    else:
+        parts = [shard_stats(path, num_keys, chunk_size) for path in shards]
+    if not parts:
+        return StateStats(num_keys or 0)
+    total = StateStats(parts[0].num_keys, parts[0].num_buttons)
+    for part in parts:
+        total.merge(part)
+    return total
@@ -0,0 +1,691 @@
+import os
+import time
+
+import h5py
+import numpy as np
+
+from codec import COMPRESSIONS, FILTERS, IMAGE_CODECS, DELTA, EncoderPool, DeltaEncoder
+from geometry import write_geometry
+from input_log import EVENT_DTYPE
+from preprocess import ChangeDetector
+
+# 每个分块的目标大小（字节），单帧超过该大小时每块只放一帧
+CHUNK_BYTES = 4 * 1024 * 1024
+# h5py 默认的分块缓存大小（字节）
+DEFAULT_CACHE_BYTES = 1024 * 1024
+
+
+def _chunk_frames(frame_shape, batch_size):
+    """
+    根据单帧大小计算每个分块包含的帧数
+    取 batch_size 的倍数或约数，使每批写入覆盖整块，不需要先读回未写满的分块
+    :param frame_shape: 单帧形状 (H, W, 3)
+    :param batch_size: 每次写盘的帧数
+    :return: 每块帧数
+    """
+    frame_bytes = int(np.prod(frame_shape))
+    rows = max(1, CHUNK_BYTES // frame_bytes)
+    if rows >= batch_size:
+        return rows // batch_size * batch_size
+    return max(d for d in range(1, rows + 1) if batch_size % d == 0)
+
+
+def _cache_bytes(chunk_bytes):
+    """
+    分块缓存大小，至少容纳一个完整分块；
+    分块比缓存大时 HDF5 不缓存，写入未满的分块要先从文件读回
+    :param chunk_bytes: frames 数据集每个分块的字节数
+    """
+    return max(DEFAULT_CACHE_BYTES, 2 * chunk_bytes)
+
+
+def _append_events(h5file, events):
+    """
+    把一批输入事件追加到 events 数据集，首次写入时创建
+    :param h5file: HDF5文件
+    :param events: EVENT_DTYPE 数组
+    """
+    if len(events) == 0:
+        return
+    if 'events' not in h5file:
+        h5file.create_dataset(
+            'events',
+            shape=(0,),
+            maxshape=(None,),
+            chunks=(4096,),
+            dtype=EVENT_DTYPE
+        )
+    dataset = h5file['events']
+    start = dataset.shape[0]
+    dataset.resize(start + len(events), axis=0)
+    dataset[start:] = events
+
+
+class _SyncTimer:
+    """
+    定期把 HDF5 缓存写入文件的计时器
+    interval 为 None 时从不主动写入（只在关闭时写入），吞吐最高；
+    为 0 时每批都写入，进程崩溃时最多丢失一批。
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._last = time.perf_counter()
+
+    def due(self):
+        """
+        距上次写入是否已超过 interval，是则重新计时
+        """
+        if self.interval is None:
+            return False
+        now = time.perf_counter()
+        if now - self._last < self.interval:
+            return False
+        self._last = now
+        return True
+
+
+class FrameStore:
+    """
+    连续布局的HDF5帧存储
+    所有画面写入一个分块、可扩展的 frames 数据集 (N, H, W, 3)，
+    状态写入 states (N, D)，实际采集时间写入 timestamps (N,)，
+    调度器给出的计划采集时间写入 scheduled (N,)。
+    帧先写入预分配的批缓冲区，攒满一批后统一 resize 并切片写入。
+
+    compression 可选:
+        'none'          不压缩
+        'gzip' / 'lzf'  HDF5 分块过滤器
+        'jpeg' / 'webp' / 'png'
+                        逐帧 cv2.imencode 编码，frames 变为 (N,) 变长字节数据集，
+                        编码在线程池中并行执行
+        'delta'         每 keyframe_interval 帧一个关键帧，其余为与前一帧的异或差分，
+                        zlib 压缩后同样存为变长字节数据集；随机读取最多解码 K 帧
+
+    指定 dedup_threshold 时启用去重：与上一张保存的画面相比没有明显变化的帧
+    只写入状态和时间戳，不再写画面；frame_index (N,) 记录每一行对应的 frames 行号，
+    读取端（dataset.Recording）据此透明展开。此时 frames 的行数少于 states。
+
+    每批写入后更新文件属性 frame_count，它之前的行都已完整写入；
+    指定 sync_interval 时按该间隔（秒）把 HDF5 缓存写入文件，进程异常退出后
+    可以用 recover.py 把分片截断到 frame_count 继续使用。
+    """
+    layout = 'contiguous'
+
+    def __init__(self, path, frame_shape, state_dim, batch_size=32,
+                 compression='none', quality=90, encode_workers=2, dedup_threshold=None,
+                 keyframe_interval=30, chunk_frames=None, sync_interval=None):
+        """
+        :param path: HDF5文件路径
+        :param frame_shape: 单帧形状 (H, W, 3)
+        :param state_dim: 状态向量维度
+        :param batch_size: 每次写盘的帧数
+        :param compression: 画面压缩方式，见类说明
+        :param quality: jpeg/webp 编码质量
+        :param encode_workers: 逐帧编码的线程数
+        :param dedup_threshold: 去重阈值（缩略图平均绝对差，0-255），None 表示不去重
+        :param keyframe_interval: 差分编码的关键帧间隔
+        :param chunk_frames: frames 数据集每个分块的帧数，None 时按 CHUNK_BYTES 和 batch_size 计算
+        :param sync_interval: 写入文件的间隔（秒），None 表示只在关闭时写入，0 表示每批写入
+        """
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"未知的压缩方式: {compression}")
+        self.path = path
+        self.frame_shape = tuple(frame_shape)
+        self.state_dim = state_dim
+        self.batch_size = batch_size
+        self.compression = compression
+        self.frame_count = 0
+        self.stored_frames = 0
+        self.first_timestamp = None
+        self.last_timestamp = None
+
+        self._sync = _SyncTimer(sync_interval)
+
+        raw = compression not in IMAGE_CODECS and compression != DELTA
+        if raw:
+            chunk_frames = chunk_frames or _chunk_frames(self.frame_shape, batch_size)
+            cache_bytes = _cache_bytes(chunk_frames * int(np.prod(self.frame_shape)))
+        else:
+            chunk_frames = chunk_frames or batch_size
+            cache_bytes = DEFAULT_CACHE_BYTES
+        self.h5file = h5py.File(path, 'w', rdcc_nbytes=cache_bytes)
+        self.h5file.attrs['layout'] = self.layout
+        self.h5file.attrs['frame_count'] = 0
+        if not raw:
+            if compression == DELTA:
+                self._encoder = DeltaEncoder(keyframe_interval, num_workers=encode_workers)
+            else:
+                self._encoder = EncoderPool(compression, quality, encode_workers)
+            self.frames = self.h5file.create_dataset(
+                'frames',
+                shape=(0,),
+                maxshape=(None,),
+                chunks=(chunk_frames,),
+                dtype=h5py.vlen_dtype(np.uint8)
+            )
+        else:
+            self._encoder = None
+            self.frames = self.h5file.create_dataset(
+                'frames',
+                shape=(0,) + self.frame_shape,
+                maxshape=(None,) + self.frame_shape,
+                chunks=(chunk_frames,) + self.frame_shape,
+                dtype=np.uint8,
+                compression=compression if compression in FILTERS else None
+            )
+        self.frames.attrs['codec'] = compression
+        self.frames.attrs['frame_shape'] = self.frame_shape
+        if compression == DELTA:
+            self.frames.attrs['keyframe_interval'] = keyframe_interval
+        self.states = self.h5file.create_dataset(
+            'states',
+            shape=(0, state_dim),
+            maxshape=(None, state_dim),
+            chunks=(1024, state_dim),
+            dtype=np.float32
+        )
+        self.timestamps = self.h5file.create_dataset(
+            'timestamps',
+            shape=(0,),
+            maxshape=(None,),
+            chunks=(1024,),
+            dtype=np.float64
+        )
+        self.scheduled = self.h5file.create_dataset(
+            'scheduled',
+            shape=(0,),
+            maxshape=(None,),
+            chunks=(1024,),
+            dtype=np.float64
+        )
+        if dedup_threshold is not None:
+            self._detector = ChangeDetector(dedup_threshold)
+            self.frame_index = self.h5file.create_dataset(
+                'frame_index',
+                shape=(0,),
+                maxshape=(None,),
+                chunks=(1024,),
+                dtype=np.int64
+            )
+            self.frame_index.attrs['dedup_threshold'] = dedup_threshold
+        else:
+            self._detector = None
+            self.frame_index = None
+
+        # 预分配批缓冲区，避免每帧分配内存
+        self._frame_buf = np.empty((batch_size,) + self.frame_shape, dtype=np.uint8)
+        self._state_buf = np.empty((batch_size, state_dim), dtype=np.float32)
+        self._time_buf = np.empty((batch_size,), dtype=np.float64)
+        self._sched_buf = np.empty((batch_size,), dtype=np.float64)
+        self._index_buf = np.empty((batch_size,), dtype=np.int64)
+        self._encoded = [None] * batch_size
+        self._pending = 0
+        self._pending_frames = 0
+
+    def __len__(self):
+        return self.frame_count + self._pending
+
+    def append(self, frame, state, timestamp, scheduled=None, encoded=None):
+        """
+        追加一帧数据，攒满一批后自动写盘
+        :param frame: 画面帧 (H, W, 3)
+        :param state: 状态向量 (D,)
+        :param timestamp: 实际采集时间戳
+        :param scheduled: 计划采集时间戳，None 表示与实际时间相同
+        :param encoded: 已在别处（如工作进程）完成的逐帧编码结果，仅逐帧编码时使用
+        """
+        i = self._pending
+        if self._detector is None or self._detector(frame):
+            j = self._pending_frames
+            if self._encoder is not None and encoded is not None:
+                self._encoded[j] = encoded
+            else:
+                self._frame_buf[j] = frame
+                self._encoded[j] = None
+            self._pending_frames += 1
+        # 未变化的帧指向最近保存的画面
+        self._index_buf[i] = self.stored_frames + self._pending_frames - 1
+        self._state_buf[i] = state
+        self._time_buf[i] = timestamp
+        self._sched_buf[i] = timestamp if scheduled is None else scheduled
+        if self.first_timestamp is None:
+            self.first_timestamp = float(timestamp)
+        self.last_timestamp = float(timestamp)
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        将缓冲区中的帧写入文件
+        """
+        n = self._pending
+        if n == 0:
+            return
+        start = self.frame_count
+        end = start + n
+        m = self._pending_frames
+        try:
+            if self._encoder is not None:
+                # 只编码还没有编码结果的帧
+                todo = [i for i in range(m) if self._encoded[i] is None]
+                data = [self._encoded[i] for i in range(m)]
+                if todo:
+                    results = self._encoder.encode_batch([self._frame_buf[i] for i in todo])
+                    for i, buf in zip(todo, results):
+                        data[i] = buf
+            else:
+                data = self._frame_buf[:m]
+            if m:
+                self.frames.resize(self.stored_frames + m, axis=0)
+                if self._encoder is not None:
+                    # 变长数据逐行写入：整批写入时等长的编码结果会被当作二维数组
+                    for i, buf in enumerate(data):
+                        self.frames[self.stored_frames + i] = buf
+                else:
+                    self.frames[self.stored_frames:self.stored_frames + m] = data
+            self.states.resize(end, axis=0)
+            self.timestamps.resize(end, axis=0)
+            self.scheduled.resize(end, axis=0)
+            self.states[start:end] = self._state_buf[:n]
+            self.timestamps[start:end] = self._time_buf[:n]
+            self.scheduled[start:end] = self._sched_buf[:n]
+            if self.frame_index is not None:
+                self.frame_index.resize(end, axis=0)
+                self.frame_index[start:end] = self._index_buf[:n]
+        except Exception:
+            self._rollback()
+            raise
+        finally:
+            # 无论成功与否都清空批缓冲区，一批写入失败不会影响后续写入
+            self._pending = 0
+            self._pending_frames = 0
+            for i in range(m):
+                self._encoded[i] = None
+        self.frame_count = end
+        self.stored_frames += m
+        # 数据写完后再更新帧数，崩溃恢复时以它为准
+        self.h5file.attrs['frame_count'] = end
+        if self._sync.due():
+            self.h5file.flush()
+
+    def _rollback(self):
+        """
+        丢弃写入失败的一批：数据集恢复到上一批结束时的大小，差分编码器回到批开始前的状态，
+        去重的参考画面清空（它可能属于被丢弃的一批），下一帧一定保存画面
+        """
+        if isinstance(self._encoder, DeltaEncoder):
+            self._encoder.rollback()
+        if self._detector is not None:
+            self._detector.reset()
+        for dataset, rows in ((self.frames, self.stored_frames), (self.states, self.frame_count),
+                              (self.timestamps, self.frame_count), (self.scheduled, self.frame_count),
+                              (self.frame_index, self.frame_count)):
+            if dataset is not None and dataset.shape[0] != rows:
+                try:
+                    dataset.resize(rows, axis=0)
+                except Exception as e:
+                    print(f"回退数据集出错: {dataset.name}: {e}")
+
+    def append_events(self, events):
+        """
+        追加输入事件到 events 数据集
+        :param events: EVENT_DTYPE 数组
+        """
+        _append_events(self.h5file, events)
+
+    def set_geometry(self, capture_rect, target_size):
+        """
+        记录采集区域和屏幕到画面的坐标变换，见 geometry.write_geometry
+        :param capture_rect: 采集区域 {'left', 'top', 'width', 'height'}
+        :param target_size: 保存的画面大小 (W, H)
+        """
+        write_geometry(self.h5file.attrs, capture_rect, target_size)
+
+    def size_bytes(self):
+        """
+        已写盘的数据量（字节），未写盘的批缓冲区和 HDF5 缓存不计入，用于按大小轮换分片
+        """
+        return os.path.getsize(self.path)
+
+    def info(self):
+        """
+        分片信息，用于登记到会话清单
+        """
+        return {
+            'path': self.path,
+            'frames': len(self),
+            'stored_frames': self.stored_frames + self._pending_frames,
+            'first_timestamp': self.first_timestamp,
+            'last_timestamp': self.last_timestamp,
+            'layout': self.layout,
+            'compression': self.compression,
+        }
+
+    def close(self):
+        """
+        写入剩余数据并关闭文件
+        """
+        self.flush()
+        if self._encoder is not None:
+            self._encoder.close()
+        self.h5file.close()
+
+
+class LegacyFrameStore:
+    """
+    旧版逐帧布局：每帧写入 frame_<n>_x 和 frame_<n>_y 两个数据集
+    保留用于兼容旧的读取工具，只支持 HDF5 过滤器压缩
+    """
+    layout = 'legacy'
+
+    def __init__(self, path, frame_shape=None, state_dim=None, batch_size=None,
+                 compression='none', sync_interval=None, **kwargs):
+        if compression not in ('none',) + FILTERS:
+            raise ValueError(f"逐帧布局不支持压缩方式: {compression}")
+        if kwargs.get('dedup_threshold') is not None:
+            raise ValueError("逐帧布局不支持去重")
+        self.path = path
+        self.compression = compression if compression in FILTERS else None
+        self.frame_count = 0
+        self.first_timestamp = None
+        self.last_timestamp = None
+        self._sync = _SyncTimer(sync_interval)
+        self.h5file = h5py.File(path, 'w')
+        self.h5file.attrs['frame_count'] = 0
+
+    def __len__(self):
+        return self.frame_count
+
+    def append(self, frame, state, timestamp, scheduled=None, encoded=None):
+        n = self.frame_count
+        self.h5file.create_dataset(f"frame_{n}_x", data=frame, compression=self.compression)
+        self.h5file.create_dataset(f"frame_{n}_y", data=state)
+        if self.first_timestamp is None:
+            self.first_timestamp = float(timestamp)
+        self.last_timestamp = float(timestamp)
+        self.frame_count += 1
+        self.h5file.attrs['frame_count'] = self.frame_count
+        if self._sync.due():
+            self.h5file.flush()
+
+    def flush(self):
+        pass
+
+    def append_events(self, events):
+        _append_events(self.h5file, events)
+
+    def set_geometry(self, capture_rect, target_size):
+        write_geometry(self.h5file.attrs, capture_rect, target_size)
+
+    def size_bytes(self):
+        return os.path.getsize(self.path)
+
+    def info(self):
+        return {
+            'path': self.path,
+            'frames': self.frame_count,
+            'first_timestamp': self.first_timestamp,
+            'last_timestamp': self.last_timestamp,
+            'layout': self.layout,
+            'compression': self.compression or 'none',
+        }
+
+    def close(self):
+        self.h5file.close()
+
+
+def _memmap_path(path, name):
+    """
+    内存映射布局中原始数组文件的路径：与 HDF5 文件同名，扩展名为数组名
+    """
+    return os.path.splitext(path)[0] + '.' + name
+
+
+def shard_files(path):
+    """
+    一个分片的全部文件：HDF5 文件，内存映射布局另有画面、状态和时间数组文件
+    :param path: HDF5文件路径
+    :return: 存在的文件路径列表
+    """
+    files = [path]
+    for name in ('frames', 'states', 'times'):
+        mapped = _memmap_path(path, name)
+        if os.path.isfile(mapped):
+            files.append(mapped)
+    return files
+
+
+def open_memmap_arrays(h5_path, h5file, mode='c'):
+    """
+    打开内存映射布局的画面和状态数组
+    默认以写时复制（'c'）方式映射：读取不复制数据，原地修改只影响当前进程
+    :param h5_path: HDF5元数据文件路径
+    :param h5file: 已打开的HDF5文件
+    :param mode: np.memmap 的打开方式
+    :return: (frames (N, H, W, 3), states (N, D))，长度以 timestamps 中已写入的帧数为准
+    """
+    attrs = h5file.attrs
+    frame_shape = tuple(int(v) for v in attrs['frame_shape'])
+    state_dim = int(attrs['state_dim'])
+    n = min(h5file['timestamps'].shape[0], int(attrs.get('frame_count', np.iinfo(np.int64).max)))
+    if n == 0:
+        # 不能映射空文件
+        return (np.empty((0,) + frame_shape, dtype=np.uint8),
+                np.empty((0, state_dim), dtype=np.float32))
+    base = os.path.dirname(h5_path)
+    frames = np.memmap(os.path.join(base, attrs['frames_file']), dtype=np.uint8, mode=mode,
+                       shape=(n,) + frame_shape)
+    states = np.memmap(os.path.join(base, attrs['states_file']), dtype=np.float32, mode=mode,
+                       shape=(n, state_dim))
+    return frames, states
+
+
+class MemmapFrameStore:
+    """
+    内存映射布局：画面和状态写入预分配的原始数组文件，读取端用 np.memmap 直接映射
+    <name>.frames 为 (capacity, H, W, 3) uint8，<name>.states 为 (capacity, D) float32，
+    <name>.times 为 (capacity, 2) float64（实际、计划采集时间），均为无文件头的 C 顺序数组；
+    <name>.h5 保存形状等元数据、timestamps、scheduled、输入事件和采集几何信息，
+    timestamps 的行数即已完整写入的帧数。
+    append() 直接写入映射内存，不经过批缓冲区；容量用完时文件按倍数扩大后重新映射，
+    关闭（包括分片轮换）时截断到实际帧数。
+    读取不经过 h5py，没有拷贝，也不受 HDF5 全局锁限制，多个数据加载进程可以并行读取。
+    只支持不压缩、不去重。
+
+    进程异常退出时，已写入映射内存的数据由操作系统写回文件（断电和系统崩溃除外）。
+    元数据文件在创建和每次扩容时写入文件，其余时候按 sync_interval（含义同 FrameStore）；
+    timestamps 没来得及写入的帧由 recover.py 根据 times 数组中已写入的行恢复。
+    """
+    layout = 'memmap'
+
+    def __init__(self, path, frame_shape, state_dim, batch_size=32, compression='none',
+                 capacity=1024, sync_interval=None, **kwargs):
+        """
+        :param path: HDF5元数据文件路径，原始数组文件写在同一目录
+        :param frame_shape: 单帧形状 (H, W, 3)
+        :param state_dim: 状态向量维度
+        :param batch_size: timestamps 每次写盘的帧数
+        :param compression: 只支持 'none'
+        :param capacity: 预分配的帧数，一般取分片的 frame_limit
+        :param sync_interval: 元数据写入文件的间隔（秒），None 表示只在创建、扩容和关闭时写入
+        """
+        if compression != 'none':
+            raise ValueError(f"内存映射布局不支持压缩方式: {compression}")
+        if kwargs.get('dedup_threshold') is not None:
+            raise ValueError("内存映射布局不支持去重")
+        self.path = path
+        self.frame_shape = tuple(frame_shape)
+        self.state_dim = state_dim
+        self.batch_size = batch_size
+        self.capacity = max(1, capacity)
+        self.frame_count = 0
+        self.first_timestamp = None
+        self.last_timestamp = None
+
+        self.frames_path = _memmap_path(path, 'frames')
+        self.states_path = _memmap_path(path, 'states')
+        self.times_path = _memmap_path(path, 'times')
+        self._sync = _SyncTimer(sync_interval)
+        self.h5file = h5py.File(path, 'w')
+        attrs = self.h5file.attrs
+        attrs['layout'] = self.layout
+        attrs['frame_count'] = 0
+        attrs['frame_shape'] = self.frame_shape
+        attrs['state_dim'] = state_dim
+        attrs['frames_file'] = os.path.basename(self.frames_path)
+        attrs['states_file'] = os.path.basename(self.states_path)
+        attrs['times_file'] = os.path.basename(self.times_path)
+        self.timestamps = self.h5file.create_dataset(
+            'timestamps',
+            shape=(0,),
+            maxshape=(None,),
+            chunks=(1024,),
+            dtype=np.float64
+        )
+        self.scheduled = self.h5file.create_dataset(
+            'scheduled',
+            shape=(0,),
+            maxshape=(None,),
+            chunks=(1024,),
+            dtype=np.float64
+        )
+        self.frames = None
+        self.states = None
+        self.times = None
+        for mapped in (self.frames_path, self.states_path, self.times_path):
+            open(mapped, 'wb').close()
+        self._map(self.capacity)
+        self._pending = 0
+
+    def _row_bytes(self):
+        """
+        三个数组文件中每帧占用的字节数
+        """
+        return int(np.prod(self.frame_shape)), self.state_dim * 4, 16
+
+    def _map(self, capacity):
+        """
+        把数组文件扩展到 capacity 帧并重新映射，已写入的内容保持不变
+        之后立即把元数据写入文件，进程异常退出时 recover.py 能打开它
+        """
+        for path, row_bytes in zip((self.frames_path, self.states_path, self.times_path),
+                                   self._row_bytes()):
+            with open(path, 'r+b') as f:
+                f.truncate(capacity * row_bytes)
+        self.frames = np.memmap(self.frames_path, dtype=np.uint8, mode='r+',
+                                shape=(capacity,) + self.frame_shape)
+        self.states = np.memmap(self.states_path, dtype=np.float32, mode='r+',
+                                shape=(capacity, self.state_dim))
+        self.times = np.memmap(self.times_path, dtype=np.float64, mode='r+',
+                               shape=(capacity, 2))
+        self.capacity = capacity
+        self.h5file.flush()
+
+    def _release(self):
+        """
+        写回并解除映射
+        """
+        if self.frames is not None:
+            for mapped in (self.frames, self.states, self.times):
+                mapped.flush()
+            self.frames = None
+            self.states = None
+            self.times = None
+
+    def __len__(self):
+        return self.frame_count
+
+    def append(self, frame, state, timestamp, scheduled=None, encoded=None):
+        """
+        追加一帧数据，画面、状态和时间直接写入映射内存，timestamps 攒满一批后写盘
+        """
+        if self.frame_count >= self.capacity:
+            self._release()
+            self._map(self.capacity * 2)
+        n = self.frame_count
+        self.frames[n] = frame
+        self.states[n] = state
+        # 时间最后写入，恢复时以它判断这一行是否完整
+        self.times[n] = (timestamp, timestamp if scheduled is None else scheduled)
+        if self.first_timestamp is None:
+            self.first_timestamp = float(timestamp)
+        self.last_timestamp = float(timestamp)
+        self.frame_count += 1
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        把新写入帧的时间写入 timestamps
+        """
+        n = self._pending
+        if n == 0:
+            return
+        end = self.frame_count
+        start = end - n
+        self.timestamps.resize(end, axis=0)
+        self.scheduled.resize(end, axis=0)
+        self.timestamps[start:end] = self.times[start:end, 0]
+        self.scheduled[start:end] = self.times[start:end, 1]
+        self._pending = 0
+        self.h5file.attrs['frame_count'] = end
+        if self._sync.due():
+            for mapped in (self.frames, self.states, self.times):
+                mapped.flush()
+            self.h5file.flush()
+
+    def append_events(self, events):
+        _append_events(self.h5file, events)
+
+    def set_geometry(self, capture_rect, target_size):
+        write_geometry(self.h5file.attrs, capture_rect, target_size)
+
+    def size_bytes(self):
+        """
+        已写入的数据量（字节），数组文件按实际帧数计算，不计预分配部分
+        """
+        return os.path.getsize(self.path) + self.frame_count * sum(self._row_bytes())
+
+    def info(self):
+        return {
+            'path': self.path,
+            'frames': self.frame_count,
+            'first_timestamp': self.first_timestamp,
+            'last_timestamp': self.last_timestamp,
+            'layout': self.layout,
+            'compression': 'none',
+        }
+
+    def close(self):
+        """
+        写入剩余数据，解除映射并把数组文件截断到实际帧数
+        """
+        self.flush()
+        self._release()
+        for path, row_bytes in zip((self.frames_path, self.states_path, self.times_path),
+                                   self._row_bytes()):
+            os.truncate(path, self.frame_count * row_bytes)
+        self.h5file.close()
+
+STORES = {
+    FrameStore.layout: FrameStore,
+    LegacyFrameStore.layout: LegacyFrameStore,
+    MemmapFrameStore.layout: MemmapFrameStore,
+}
+
+
+def open_store(path, frame_shape, state_dim, layout='contiguous', **kwargs):
+    """
+    按布局名称创建帧存储
+    :param path: HDF5文件路径
+    :param frame_shape: 单帧形状 (H, W, 3)
+    :param state_dim: 状态向量维度
+    :param layout: 'contiguous' / 'legacy' / 'memmap'
+    :return: 帧存储对象
+    """
+    if layout not in STORES:
+        raise ValueError(f"未知的存储布局: {layout}")
+    return STORES[layout](path, frame_shape, state_dim, **kwargs)
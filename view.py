@@ -1,10 +1,18 @@
-import h5py
 import numpy as np
 import cv2
 
+from dataset import Recording
+from geometry import read_geometry, to_frame
+from playback import Player
+from stats import StateStats, session_stats
+
+# 按键名称，顺序与录制时的 key_map 一致
+KEY_NAMES = ['↑', '↓', '←', '→', 'W', 'A', 'S', 'D', 'J', 'K', 'L']
+
 def load_gameplay_data(h5_path):
     """
     加载游戏录制数据，包含键盘和鼠标信息
+    一次性读入全部数据；大文件请直接使用 dataset.Recording 按需读取
     
     Args:
         h5_path: HDF5文件路径
@@ -13,42 +21,31 @@ def load_gameplay_data(h5_path):
         frames: 所有游戏画面帧的numpy数组
         states: 所有控制状态的numpy数组（包含键盘和鼠标信息）
     """
-    frames = []
-    states = []
-    
-    with h5py.File(h5_path, 'r') as f:
-        # 获取所有数据集名称并排序
-        frame_names = sorted([k for k in f.keys() if k.endswith('_x')], 
-                           key=lambda x: int(x.split('_')[1]))
-        
-        for frame_name in frame_names:
-            # 获取帧号
-            frame_idx = frame_name.split('_')[1]
-            
-            # 加载画面帧
-            frame = f[f'frame_{frame_idx}_x'][:]
-            frames.append(frame)
-            
-            # 加载对应的状态数据
-            state = f[f'frame_{frame_idx}_y'][:]
-            states.append(state)
-    
-    return np.array(frames), np.array(states)
+    # 直接读入预分配的数组，不再经过 Python 列表中转
+    with Recording(h5_path) as rec:
+        return rec[:]
+
+def _default_transform(frame_shape):
+    """
+    没有几何信息时的屏幕到画面变换（按 1920x1080 全屏录制推算）
+    """
+    return read_geometry({}, frame_shape)['screen_to_frame']
 
-def draw_mouse_cursor(frame, x, y, buttons):
+def draw_mouse_cursor(frame, x, y, buttons, transform=None):
     """
     在画面上绘制鼠标光标和按键状态
     
     Args:
         frame: 画面帧
-        x: 鼠标X坐标
-        y: 鼠标Y坐标
+        x: 鼠标X坐标（屏幕坐标）
+        y: 鼠标Y坐标（屏幕坐标）
         buttons: 鼠标按键状态列表 [左键, 右键, 中键]
+        transform: 屏幕到画面的坐标变换，即 Recording.geometry['screen_to_frame']
     """
-    # 缩放鼠标坐标以匹配显示尺寸
-    h, w = frame.shape[:2]
-    x = int(x * w / 1920)  # 假设原始分辨率为1920x1080
-    y = int(y * h / 1080)
+    # 把屏幕坐标映射到画面坐标
+    if transform is None:
+        transform = _default_transform(frame.shape)
+    x, y = to_frame((x, y), transform).astype(int).tolist()
     
     # 绘制鼠标十字光标
     color = (0, 255, 255)  # 黄色
@@ -67,18 +64,20 @@ def draw_mouse_cursor(frame, x, y, buttons):
     if buttons[2]:  # 中键
         cv2.circle(frame, (x, y), size + 11, (0, 255, 0), 2)  # 绿圈
 
-def draw_velocity_vector(frame, x, y, dx, dy):
+def draw_velocity_vector(frame, x, y, dx, dy, transform=None):
     """
     绘制鼠标速度向量
     
     Args:
         frame: 画面帧
-        x, y: 当前鼠标位置
+        x, y: 当前鼠标位置（屏幕坐标）
         dx, dy: 鼠标在X和Y方向的速度
+        transform: 屏幕到画面的坐标变换
     """
     h, w = frame.shape[:2]
-    x = int(x * w / 1920)
-    y = int(y * h / 1080)
+    if transform is None:
+        transform = _default_transform(frame.shape)
+    x, y = to_frame((x, y), transform).astype(int).tolist()
     
     # 计算速度向量终点
     scale = 0.1  # 速度向量显示比例
@@ -94,56 +93,132 @@ def draw_velocity_vector(frame, x, y, dx, dy):
         cv2.arrowedLine(frame, (x, y), (end_x, end_y), 
                        (0, 255, 0), 2, tipLength=0.3)
 
-def visualize_recording(frames, states, start_frame=0, fps=30):
+def overlay_geometry(states, frame_shape, key_names=KEY_NAMES, transform=None):
     """
-    可视化播放录制的游戏内容，包括键盘和鼠标状态
+    一次性计算所有帧叠加层的几何信息和文字，绘制时每帧只剩 OpenCV 绘图调用
+    坐标缩放、速度向量终点和裁剪都用 NumPy 对整段状态向量化计算
     
     Args:
-        frames: 游戏画面帧数组
-        states: 控制状态数组（键盘+鼠标）
-        start_frame: 开始播放的帧索引
-        fps: 播放帧率
+        states: 控制状态数组 (N, D)
+        frame_shape: 画面形状 (H, W, 3)
+        key_names: 按键名称，顺序与状态向量一致
+        transform: 屏幕到画面的坐标变换，即 Recording.geometry['screen_to_frame']，
+            None 时按 1920x1080 全屏录制推算
+        
+    Returns:
+        dict: cursor (N, 2) 光标像素坐标, arrow_end (N, 2) 速度向量终点,
+              arrow (N,) 是否绘制速度向量, buttons (N, 3) 鼠标按键,
+              texts 每帧的三行文字
     """
-    # 按键映射说明
-    key_names = ['↑', '↓', '←', '→', 'W', 'A', 'S', 'D', 'J', 'K', 'L']
+    states = np.asarray(states, dtype=np.float32)
+    states = states.reshape(-1, states.shape[-1])
     num_keys = len(key_names)
+    h, w = frame_shape[:2]
+    position = states[:, num_keys:num_keys+2]
+    velocity = states[:, num_keys+2:num_keys+4]
     
-    for i in range(start_frame, len(frames)):
-        frame = frames[i].copy()
-        state = states[i]
-        
-        # 解析状态数据
-        key_states = state[:num_keys]  # 键盘状态
-        mouse_x, mouse_y = state[num_keys:num_keys+2]  # 鼠标位置
-        mouse_dx, mouse_dy = state[num_keys+2:num_keys+4]  # 鼠标速度
-        mouse_buttons = state[num_keys+4:]  # 鼠标按键
-        
-        # 在画面上显示当前按键状态
-        active_keys = [key_names[j] for j, state in enumerate(key_states) if state == 1]
-        key_text = ' '.join(active_keys)
-        cv2.putText(frame, f"Keys: {key_text}", (10, 30), 
+    # 与 draw_mouse_cursor / draw_velocity_vector 相同的坐标映射和取整
+    if transform is None:
+        transform = _default_transform(frame_shape)
+    cursor = to_frame(position, transform).astype(np.int32)
+    arrow_end = (cursor + velocity * 0.1).astype(np.int32)
+    np.clip(arrow_end, 0, [w - 1, h - 1], out=arrow_end)
+    arrow = np.any(np.abs(velocity) > 1, axis=1)
+    buttons = states[:, num_keys+4:num_keys+7] != 0
+    
+    # 按键组合编码成整数，相同组合只拼接一次文字
+    codes = (states[:, :num_keys] == 1) @ (1 << np.arange(num_keys))
+    key_texts = {}
+    for code in np.unique(codes):
+        key_texts[code] = 'Keys: ' + ' '.join(k for j, k in enumerate(key_names) if code >> j & 1)
+    position = position.astype(np.int64)
+    velocity = velocity.astype(np.int64)
+    texts = [
+        (key_texts[c], f"Mouse: ({px}, {py})", f"Velocity: ({vx}, {vy})")
+        for c, (px, py), (vx, vy) in zip(codes, position.tolist(), velocity.tolist())
+    ]
+    return {
+        'cursor': cursor,
+        'arrow_end': arrow_end,
+        'arrow': arrow,
+        'buttons': buttons,
+        'texts': texts,
+    }
+
+def draw_overlay_at(frame, geometry, i):
+    """
+    按 overlay_geometry 的预计算结果在画面上原地绘制第 i 帧的叠加层
+    
+    Args:
+        frame: 画面帧，会被修改
+        geometry: overlay_geometry 的返回值
+        i: 帧在 geometry 中的下标
+    """
+    for line, text in enumerate(geometry['texts'][i]):
+        cv2.putText(frame, text, (10, 30 + 30 * line), 
                     cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-        
-        # 显示鼠标位置和速度信息
-        cv2.putText(frame, f"Mouse: ({int(mouse_x)}, {int(mouse_y)})", 
-                    (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-        cv2.putText(frame, f"Velocity: ({int(mouse_dx)}, {int(mouse_dy)})", 
-                    (10, 90), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-        
-        # 绘制鼠标光标
-        draw_mouse_cursor(frame, mouse_x, mouse_y, mouse_buttons)
-        
-        # 绘制速度向量
-        draw_velocity_vector(frame, mouse_x, mouse_y, mouse_dx, mouse_dy)
-        
-        # 显示画面
-        cv2.imshow('Recording Playback', frame)
-        
-        # ESC键退出播放
-        if cv2.waitKey(int(1000/fps)) & 0xFF == 27:
-            break
     
-    cv2.destroyAllWindows()
+    # 鼠标十字光标和按键圆圈
+    x, y = geometry['cursor'][i].tolist()
+    size = 10
+    cv2.line(frame, (x - size, y), (x + size, y), (0, 255, 255), 2)
+    cv2.line(frame, (x, y - size), (x, y + size), (0, 255, 255), 2)
+    left, right, middle = geometry['buttons'][i]
+    if left:
+        cv2.circle(frame, (x, y), size + 5, (0, 0, 255), 2)
+    if right:
+        cv2.circle(frame, (x, y), size + 8, (255, 0, 0), 2)
+    if middle:
+        cv2.circle(frame, (x, y), size + 11, (0, 255, 0), 2)
+    
+    # 速度向量
+    if geometry['arrow'][i]:
+        end = tuple(geometry['arrow_end'][i].tolist())
+        cv2.arrowedLine(frame, (x, y), end, (0, 255, 0), 2, tipLength=0.3)
+
+def draw_overlay(frame, state, key_names=KEY_NAMES, transform=None):
+    """
+    在画面上原地绘制单帧的按键、鼠标位置/速度文字、光标和速度向量
+    批量绘制时先用 overlay_geometry 计算整段，再逐帧调用 draw_overlay_at
+    
+    Args:
+        frame: 画面帧，会被修改
+        state: 该帧的控制状态（键盘+鼠标）
+        key_names: 按键名称，顺序与状态向量一致
+        transform: 屏幕到画面的坐标变换
+    """
+    geometry = overlay_geometry(np.asarray(state)[None], frame.shape, key_names, transform)
+    draw_overlay_at(frame, geometry, 0)
+
+def visualize_recording(frames, states, start_frame=0, fps=30, timestamps=None, speed=1.0,
+                        transform=None):
+    """
+    可视化播放录制的游戏内容，包括键盘和鼠标状态
+    画面在后台线程中按块预读，播放按挂钟时间同步，绘制跟不上时丢帧。
+    播放控制: 空格/k 暂停, j/l 后退/前进10秒, ,/. 逐帧, -/= 减速/加速, ESC/q 退出
+    
+    Args:
+        frames: 游戏画面帧数组，或 Recording.frames 惰性序列
+        states: 控制状态数组（键盘+鼠标）
+        start_frame: 开始播放的帧索引
+        fps: 没有时间戳时的播放帧率
+        timestamps: 采集时间戳，给定时按实际采集节奏回放
+        speed: 播放倍速
+        transform: 屏幕到画面的坐标变换，即 Recording.geometry['screen_to_frame']
+    """
+    if len(frames) == 0:
+        return
+    # 整段预先计算叠加层，播放时每帧只做绘制
+    geometry = overlay_geometry(states, frames[0].shape, transform=transform)
+    player = Player(
+        frames, states,
+        timestamps=timestamps,
+        render=lambda canvas, index, state: draw_overlay_at(canvas, geometry, index),
+        fps=fps,
+        speed=speed
+    )
+    player.run(start_frame)
+    print(f"显示 {player.shown} 帧, 丢弃 {player.dropped} 帧")
 
 def analyze_recording(states):
     """
@@ -152,53 +227,54 @@ def analyze_recording(states):
     Args:
         states: 控制状态数组
     """
-    num_frames = len(states)
-    key_names = ['↑', '↓', '←', '→', 'W', 'A', 'S', 'D', 'J', 'K', 'L']
-    num_keys = len(key_names)
+    report_stats(StateStats.from_states(states, len(KEY_NAMES)))
+
+def analyze_session(paths, workers=1):
+    """
+    分块统计一个或多个会话的全部分片，只读取状态，内存占用与帧数无关
     
-    # 计算按键使用频率
-    key_usage = np.sum(states[:, :num_keys], axis=0)
-    key_frequency = key_usage / num_frames * 100
+    Args:
+        paths: 分片路径、会话目录或通配符，或它们的列表
+        workers: 并行统计的进程数，按分片划分
+    """
+    report_stats(session_stats(paths, len(KEY_NAMES), workers=workers))
+
+def report_stats(stats, key_names=KEY_NAMES):
+    """
+    打印 StateStats 的统计结果
     
+    Args:
+        stats: stats.StateStats
+        key_names: 按键名称
+    """
+    print(f"\n共 {stats.num_frames} 帧")
     print("\n按键使用分析:")
-    for i, (key, freq) in enumerate(zip(key_names, key_frequency)):
-        print(f"{key}: {freq:.1f}% ({int(key_usage[i])}次)")
-    
-    # 分析鼠标移动
-    mouse_positions = states[:, num_keys:num_keys+2]
-    mouse_velocities = states[:, num_keys+2:num_keys+4]
-    mouse_buttons = states[:, num_keys+4:]
+    for key, freq, usage in zip(key_names, stats.key_frequency, stats.key_usage):
+        print(f"{key}: {freq:.1f}% ({int(usage)}次)")
     
-    # 计算鼠标移动总距离
-    dist = np.sqrt(np.sum(np.diff(mouse_positions, axis=0)**2, axis=1))
-    total_distance = np.sum(dist)
-    
-    # 计算平均速度
-    avg_velocity = np.mean(np.sqrt(mouse_velocities[:, 0]**2 + mouse_velocities[:, 1]**2))
-    
-    # 计算鼠标按键使用次数
     button_names = ['左键', '右键', '中键']
-    button_clicks = np.sum(np.diff(mouse_buttons, axis=0) > 0, axis=0)
-    
     print("\n鼠标使用分析:")
-    print(f"总移动距离: {total_distance:.1f}像素")
-    print(f"平均移动速度: {avg_velocity:.1f}像素/秒")
+    print(f"总移动距离: {stats.total_distance:.1f}像素")
+    print(f"平均移动速度: {stats.avg_velocity:.1f}像素/秒")
     print("\n鼠标按键使用次数:")
-    for name, clicks in zip(button_names, button_clicks):
+    for name, clicks in zip(button_names, stats.button_clicks):
         print(f"{name}: {clicks}次")
 
 # 使用示例
 if __name__ == "__main__":
-    # 加载录制数据
+    # 打开录制数据，画面按需从磁盘读取
     h5_path = "20250108_190732/record.h5"  # 替换为你的实际文件路径
-    frames, states = load_gameplay_data(h5_path)
+    rec = Recording(h5_path)
+    states = rec.states
     
-    print(f"加载了 {len(frames)} 帧数据")
-    print(f"画面尺寸: {frames[0].shape}")
+    print(f"共 {len(rec)} 帧数据")
+    print(f"画面尺寸: {rec.frame_shape}")
     print(f"状态向量维度: {states[0].shape}")
     
-    # 分析录制数据
+    # 分析录制数据；整个会话目录可以用 analyze_session 分块统计
     analyze_recording(states)
     
     # 可视化播放
-    visualize_recording(frames, states)
+    transform = rec.geometry['screen_to_frame'] if rec.geometry is not None else None
+    visualize_recording(rec.frames, states, timestamps=rec.timestamps, transform=transform)
+    rec.close()